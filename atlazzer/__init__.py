@@ -19,9 +19,11 @@ from bpy.types import Object, Mesh, Operator, Menu
 from typing import List
 
 addon_modules = [
+    'atlazzer.batch',
     'atlazzer.constant',
     'atlazzer.draw',
     'atlazzer.operator',
+    'atlazzer.pack',
     'atlazzer.panel',
     'atlazzer.prop',
     'atlazzer.util',
@@ -63,6 +65,8 @@ classes = [
     operator.AtlasPackHeuristicOperator,
     operator.AtlasPack2048Operator,
     operator.AtlasPackShelfOperator,
+    operator.AtlasPackMaxRectsOperator,
+    operator.AtlasPackIncrementalOperator,
     operator.AtlasBakeOperator,
     operator.AtlasReplaceResourcesOperator,
     operator.UVUnwrapPolygonsOperator,
@@ -89,6 +93,7 @@ def register():
     bpy.types.Scene.material_props = bpy.props.PointerProperty(type = prop.MaterialProperties)
 
 def unregister():
+    prop.set_regions(None, False)
     for cls in reversed(classes):
         bpy.utils.unregister_class(cls)
     bpy.types.VIEW3D_MT_uv_map.remove(panel.menu_VIEW3D_MT_uv_map)
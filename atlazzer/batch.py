@@ -0,0 +1,79 @@
+import os, sys
+import argparse
+import json
+import time
+from typing import List, Dict
+
+import bpy
+from bpy.types import Object
+
+# Pack algorithms which don't need an image editor
+pack_operators = {
+    'SQUARE': lambda props: bpy.ops.atlas.pack_heuristic(time = props.pack_analysis_time, scale = props.pack_scale, metric = 'SQUARE', workers = props.pack_workers),
+    'OCCUPIED': lambda props: bpy.ops.atlas.pack_heuristic(time = props.pack_analysis_time, scale = props.pack_scale, metric = 'OCCUPIED', workers = props.pack_workers),
+    'SHELF': lambda props: bpy.ops.atlas.pack_shelf(scale = props.pack_scale),
+    'MAXRECTS': lambda props: bpy.ops.atlas.pack_maxrects(scale = props.pack_scale),
+    '2048': lambda props: bpy.ops.atlas.pack_2048()
+}
+
+def collect(objects:List[str] = (), collections:List[str] = ()) -> List[Object]:
+    '''Finds mesh objects by object and collection names'''
+    found = [bpy.data.objects[name] for name in objects]
+    for name in collections:
+        found.extend(bpy.data.collections[name].all_objects)
+    visited = set()
+    return [o for o in found if o.type == 'MESH' and not (o in visited or visited.add(o))]
+
+def bake(objects:List[Object], export:str|None = None, atlas_w:int|None = None, atlas_h:int|None = None, algorithm:str|None = None, find = True, replace = True) -> Dict[str, float]:
+    '''Runs the whole atlas pipeline without UI, returns seconds spent by each stage'''
+    context = bpy.context
+    props = context.scene.atlas_props
+    if export is not None: props.export = export
+    if atlas_w is not None: props.atlas_w = atlas_w
+    if atlas_h is not None: props.atlas_h = atlas_h
+    algorithm = algorithm or props.pack_algorithm
+    if algorithm not in pack_operators:
+        raise ValueError(f'Pack algorithm {algorithm} requires image editor, use one of {", ".join(pack_operators)}')
+    os.makedirs(os.path.normpath(bpy.path.abspath(props.export)), exist_ok = True)
+
+    stages = []
+    if find: stages.append(('find', lambda: bpy.ops.region.find_resources()))
+    stages.append(('calc_sizes', lambda: bpy.ops.region.calc_all_sizes()))
+    stages.append(('pack', lambda: pack_operators[algorithm](props)))
+    stages.append(('bake', lambda: bpy.ops.atlas.bake()))
+    if replace: stages.append(('replace', lambda: bpy.ops.atlas.replace_resources()))
+
+    timings = {}
+    with context.temp_override(selected_objects = objects, selected_editable_objects = objects, active_object = objects[0], object = objects[0]):
+        for name, stage in stages:
+            start = time.perf_counter()
+            result = stage()
+            timings[name] = time.perf_counter() - start
+            if 'FINISHED' not in result:
+                raise RuntimeError(f'Stage {name} failed: {result}')
+    return timings
+
+# blender -b file.blend --python-expr "from atlazzer import batch; batch.main()" -- --collections Props --export //atlas
+def main(argv:List[str]|None = None):
+    if argv is None:
+        argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    parser = argparse.ArgumentParser(prog = 'atlazzer', description = 'Bakes atlas of objects without UI')
+    parser.add_argument('--objects', nargs = '*', default = [])
+    parser.add_argument('--collections', nargs = '*', default = [])
+    parser.add_argument('--export', default = None)
+    parser.add_argument('--size', nargs = 2, type = int, default = None, metavar = ('W', 'H'))
+    parser.add_argument('--algorithm', default = None, choices = list(pack_operators))
+    parser.add_argument('--no-find', action = 'store_true')
+    parser.add_argument('--no-replace', action = 'store_true')
+    parser.add_argument('--save', action = 'store_true', help = 'Save .blend file after baking')
+    args = parser.parse_args(argv)
+
+    objects = collect(args.objects, args.collections)
+    if not objects:
+        parser.error('No mesh objects found')
+    w, h = args.size or (None, None)
+    timings = bake(objects, args.export, w, h, args.algorithm, find = not args.no_find, replace = not args.no_replace)
+    if args.save:
+        bpy.ops.wm.save_mainfile()
+    print(json.dumps(timings))
+    return timings
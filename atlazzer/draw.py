@@ -1,39 +1,139 @@
 from typing import Callable, List
 
 import bpy
-from bpy.types import Object
+from bpy.app.handlers import persistent
+from bpy.types import Object, Mesh
 import gpu
 from gpu.types import GPUVertFormat, GPUVertBuf, GPUIndexBuf, GPUShader
 from gpu_extras.batch import batch_for_shader
 from mathutils import Color, Vector
 
 class Painter:
+    # Mesh name: (x, y, w, h), drawn instead of region placement while it is being edited
+    previews = {}
+    # Combined batch of all regions, None when it must be rebuilt
+    regions = None
+    # Mesh pointer: [batch, placement when uv was read, placement seen by the last update]
+    islands = {}
+
     @staticmethod
-    def uvsquare(objects, thickness = 1):
-        shader = gpu.shader.from_builtin('UNIFORM_COLOR')
-        def draw():
-            for obj in objects:
-                props = obj.data.region_props
-                x = props.x
-                y = props.y
-                w = props.w
-                h = props.h
-                coords = [
-                    (x,     y,     0), (x + w, y,     0),
-                    (x + w, y,     0), (x + w, y + h, 0),
-                    (x + w, y + h, 0), (x,     y + h, 0),
-                    (x,     y + h, 0), (x,     y,     0),
-                ]
-                batch = batch_for_shader(shader, 'LINES', {'pos': coords})
-                
-                h = hash(obj.name)
-                shader.uniform_float('color', Vector((
-                    (h & 0xFF) / 255,
-                    ((h >> 8) & 0xFF) / 255,
-                    ((h >> 16) & 0xFF) / 255,
-                    1
-                )).normalized())
-                
-                gpu.state.line_width_set(thickness)
+    @persistent
+    def reset(*args):
+        '''Drops all cached batches and previews, used as load handler'''
+        Painter.regions = None
+        Painter.islands.clear()
+        Painter.previews.clear()
+
+    @staticmethod
+    @persistent
+    def invalidate(scene = None, depsgraph = None):
+        '''Marks cached batches as outdated, also used as depsgraph handler'''
+        Painter.regions = None
+        if depsgraph is None: return
+        for update in depsgraph.updates:
+            if not update.is_updated_geometry or not isinstance(update.id, Mesh): continue
+            mesh = update.id.original
+            cached = Painter.islands.get(mesh.as_pointer())
+            if cached is None: continue
+            props = mesh.region_props
+            placement = (props.x, props.y, props.w, props.h)
+            # NOTE Region transform changes placement and is compensated by the matrix,
+            # other uv edits keep placement, so the uv must be read again
+            if placement == cached[2]:
+                del Painter.islands[mesh.as_pointer()]
+            else:
+                cached[2] = placement
+
+    @staticmethod
+    def preview(name:str, rect):
+        if rect is None: Painter.previews.pop(name, None)
+        else: Painter.previews[name] = rect
+        Painter.invalidate()
+
+    @staticmethod
+    def color(name:str):
+        h = hash(name)
+        return tuple(Vector((
+            (h & 0xFF) / 255,
+            ((h >> 8) & 0xFF) / 255,
+            ((h >> 16) & 0xFF) / 255,
+            1
+        )).normalized())
+
+    @staticmethod
+    def uvsquare_batch(shader:GPUShader):
+        coords = []
+        colors = []
+        for obj in bpy.context.selected_objects:
+            if obj.type != 'MESH': continue
+            props = obj.data.region_props
+            x, y, w, h = Painter.previews.get(obj.data.name) or (props.x, props.y, props.w, props.h)
+            coords.extend((
+                (x,     y,     0), (x + w, y,     0),
+                (x + w, y,     0), (x + w, y + h, 0),
+                (x + w, y + h, 0), (x,     y + h, 0),
+                (x,     y + h, 0), (x,     y,     0),
+            ))
+            colors.extend((Painter.color(obj.name), ) * 8)
+        return batch_for_shader(shader, 'LINES', {'pos': coords, 'color': colors}) if coords else False
+
+    @staticmethod
+    def uvislands_batch(shader:GPUShader, mesh:Mesh):
+        '''Reads uv edges of the mesh once, later region changes are applied by matrix'''
+        import numpy as np
+
+        uv = mesh.uv_layers.active
+        if uv is None or not mesh.polygons: return False
+        coords = np.zeros((len(uv.uv), 3), dtype = np.float32)
+        flat = np.empty(len(uv.uv) * 2, dtype = np.float32)
+        uv.uv.foreach_get('vector', flat)
+        coords[:, :2] = flat.reshape(-1, 2)
+        starts = np.empty(len(mesh.polygons), dtype = np.int32)
+        totals = np.empty(len(mesh.polygons), dtype = np.int32)
+        mesh.polygons.foreach_get('loop_start', starts)
+        mesh.polygons.foreach_get('loop_total', totals)
+        # Each loop is connected with the next loop of its polygon, the last one with the first
+        loops = np.arange(len(coords), dtype = np.int32)
+        following = loops + 1
+        following[starts + totals - 1] = starts
+        edges = np.stack((loops, following), axis = 1)
+        return batch_for_shader(shader, 'LINES', {'pos': coords}, indices = edges)
+
+    @staticmethod
+    def uvislands(shader:GPUShader):
+        for obj in bpy.context.selected_objects:
+            if obj.type != 'MESH': continue
+            mesh = obj.data
+            props = mesh.region_props
+            placement = (props.x, props.y, props.w, props.h)
+            # NOTE Names repeat across files, the pointer identifies this very mesh
+            key = mesh.as_pointer()
+            cached = Painter.islands.get(key)
+            if cached is None:
+                cached = Painter.islands[key] = [Painter.uvislands_batch(shader, mesh), placement, placement]
+            batch, (x0, y0, w0, h0), _ = cached
+            if not batch: continue
+            x, y, w, h = Painter.previews.get(mesh.name) or placement
+            sx = w / w0
+            sy = h / h0
+            with gpu.matrix.push_pop():
+                gpu.matrix.translate((x - x0 * sx, y - y0 * sy))
+                gpu.matrix.scale((sx, sy))
+                shader.uniform_float('color', Painter.color(obj.name))
                 batch.draw(shader)
-        return draw
\ No newline at end of file
+
+    @staticmethod
+    def uvsquare(thickness = 1):
+        shader = gpu.shader.from_builtin('SMOOTH_COLOR')
+        islands = gpu.shader.from_builtin('UNIFORM_COLOR')
+        def draw():
+            if bpy.context.scene.atlas_props.draw_islands:
+                gpu.state.line_width_set(1)
+                Painter.uvislands(islands)
+            # NOTE Batch is rebuilt only after depsgraph updates (selection, uv, region) or preview changes
+            if Painter.regions is None:
+                Painter.regions = Painter.uvsquare_batch(shader)
+            if not Painter.regions: return
+            gpu.state.line_width_set(thickness)
+            Painter.regions.draw(shader)
+        return draw
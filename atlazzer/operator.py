@@ -2,21 +2,22 @@ import subprocess
 import os, sys
 from typing import List, Tuple, Dict, Any
 import math
-from functools import reduce
-from random import choice, randint, random
+from random import randint, random
 import time
 from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
 import math
 
 import bpy
 from bpy.types import Operator, Context, Event, Image, Mesh, Object, UILayout, ShaderNodeTexImage
 from bpy.props import StringProperty, BoolProperty, FloatProperty, IntProperty, EnumProperty
-from mathutils import Vector, Matrix
 
 from . import constant
 from . import util
 from . import prop
 from . import struct
+from . import pack
+from . draw import Painter
 
 class InstallImageProcessingOperator(Operator):
     bl_idname = 'wm.install_image_processing'
@@ -52,8 +53,7 @@ class RegionScaleOperator(bpy.types.Operator):
 
     def execute(self, context:Context):
         region = bpy.data.objects[self.target].data.region_props
-        region.w *= self.factor
-        region.h *= self.factor
+        region.transform(w = region.w * self.factor, h = region.h * self.factor)
         return {'FINISHED'}
 
     def invoke(self, context:Context, event:Event):
@@ -80,21 +80,25 @@ class RegionMoveOperator(Operator):
         return context.mode == 'OBJECT'
 
     def modal(self, context:Context, event:Event):
-        if event.type == 'MOUSEMOVE':  # Apply
+        region = bpy.data.objects[self.target].data.region_props
+        if event.type == 'MOUSEMOVE':  # Preview
+            # NOTE Only the overlay follows the mouse, uv is rewritten once on confirm
             area = context.space_data
             sx, sy = area.zoom
-            region = bpy.data.objects[self.target].data.region_props
-            region.x += (event.mouse_x - event.mouse_prev_x) / context.region.width / sx
-            region.y += (event.mouse_y - event.mouse_prev_y) / context.region.height / sy
+            self.x += (event.mouse_x - event.mouse_prev_x) / context.region.width / sx
+            self.y += (event.mouse_y - event.mouse_prev_y) / context.region.height / sy
+            Painter.preview(region.id_data.name, (self.x, self.y, region.w, region.h))
             context.area.tag_redraw()
 
         elif event.type == 'LEFTMOUSE':  # Confirm
+            Painter.preview(region.id_data.name, None)
+            region.transform(x = self.x, y = self.y)
+            context.area.tag_redraw()
             return {'FINISHED'}
         
         elif event.type in {'RIGHTMOUSE', 'ESC'}:  # Cancel
-            region = bpy.data.objects[self.target].data.region_props
-            region.x = self.x
-            region.y = self.y
+            Painter.preview(region.id_data.name, None)
+            context.area.tag_redraw()
             return {'CANCELLED'}
         
         return {'RUNNING_MODAL'}
@@ -199,12 +203,18 @@ class RegionCalcSizeOperator(Operator):
 
     def execute(self, context:Context):
         mesh = bpy.data.objects[self.target].data
-        if mesh.region_resources and hasattr(context.space_data, 'image') and context.space_data.image:
-            mesh.region_props.xw = max(r.image.size[0] for r in mesh.region_resources)
-            mesh.region_props.xh = max(r.image.size[1] for r in mesh.region_resources)
+        images = [r.image for r in mesh.region_resources if r.image]
+        if images and hasattr(context.space_data, 'image') and context.space_data.image:
+            mesh.region_props.xw = max(i.size[0] for i in images)
+            mesh.region_props.xh = max(i.size[1] for i in images)
+        elif images:
+            # Without image editor sizes are relative to the atlas size
+            mesh.region_props.transform(
+                w = max(i.size[0] for i in images) / context.scene.atlas_props.atlas_w,
+                h = max(i.size[1] for i in images) / context.scene.atlas_props.atlas_h
+            )
         else:
-            mesh.region_props.w = 1
-            mesh.region_props.h = 1
+            mesh.region_props.transform(w = 1, h = 1)
         return {'FINISHED'}
 
     def invoke(self, context:Context, event:Event):
@@ -253,11 +263,7 @@ class RegionResetSizeOperator(Operator):
         
         for obj in context.selected_objects:
             if obj.type != 'MESH': continue
-            props = obj.data.region_props
-            props.x = 0
-            props.y = 0
-            props.w = 1
-            props.h = 1
+            obj.data.region_props.transform(0, 0, 1, 1)
 
         bpy.ops.object.mode_set(mode = mode)
         return {'FINISHED'}
@@ -275,29 +281,41 @@ class RegionFindResourcesOperator(Operator):
         # Since props are linked to object data, we find resources for data, not object
         visited = set()
         objects = [o for o in sort if not (o.data in visited or visited.add(o.data))]
+
+        start = time.perf_counter()
+        index = util.NameIndex(bpy.data.images)
+        elapsed = time.perf_counter() - start
+
+        total = 0
         for obj in objects:
             mesh = obj.data
 
-            loaded = [r.image for r in mesh.region_resources]
+            loaded = set(r.image for r in mesh.region_resources)
             extra = []
 
             # Find in materials
             for material in obj.data.materials:
                 if material is None: continue
-                extra.extend(n.image for n in material.node_tree.nodes if hasattr(n, 'image') and n.image not in loaded)
+                extra.extend(n.image for n in material.node_tree.nodes if hasattr(n, 'image') and n.image is not None)
 
             # Find in names
-            extra.extend(i for i in bpy.data.images if (i.name.startswith(obj.name) or i.name.endswith(obj.name)) and i not in loaded)
-            
-            extra = list(filter(lambda i: util.apply_fitler(i.name, context.scene.atlas_props.filter, name = obj.name), extra))
+            candidates = index.match(obj.name)
+            extra.extend(candidates)
+
+            extra = [i for i in extra if not (i in loaded or loaded.add(i))]
+            matches = util.apply_fitler_many([i.name for i in extra], context.scene.atlas_props.filter, name = obj.name)
+            extra = [i for i, match in zip(extra, matches) if match]
             # We sort images so order of color, roughnes, normal, etc will be the same for all objects
             extra.sort(key = lambda i: i.name)
+            print(f'{obj.name}: {len(candidates)} name candidates, {len(extra)} added')
+            total += len(extra)
 
             for image in extra:
                 resource = mesh.region_resources.add()
                 resource.image = image
                 mesh.region_resource_index = len(mesh.region_resources) - 1
                 resource.layer = f'color{mesh.region_resource_index}'
+        self.report({'INFO'}, f'Added {total} images to {len(objects)} objects, indexing {len(index.items)} images took {elapsed * 1000:.1f} ms')
         return {'FINISHED'}
 
 
@@ -342,9 +360,10 @@ class RegionRenameResourcesOperator(Operator):
     def execute(self, context:Context):
         meshes = [m for m in set(o.data for o in context.selected_objects if o.type == 'MESH')]
         for mesh in meshes:
-            for resource in mesh.region_resources:
-                if not resource.image: continue
-                if not util.apply_fitler(resource.image.name, self.filter, name = mesh.id_data.name): continue
+            resources = [r for r in mesh.region_resources if r.image]
+            matches = util.apply_fitler_many([r.image.name for r in resources], self.filter, name = mesh.id_data.name)
+            for resource, match in zip(resources, matches):
+                if not match: continue
                 resource.layer = self.replace
         return {'FINISHED'}
 
@@ -385,14 +404,6 @@ class AtlasCreateOperator(Operator):
 
 
 class AtlasPackHeuristicOperator(Operator):
-    class Rect:
-        def __init__(self, proto, x, y, w, h):
-            self.proto = proto
-            self.x = x
-            self.y = y
-            self.w = w
-            self.h = h
-
     bl_idname = 'atlas.pack_heuristic'
     bl_label = 'Pack Atlas'
     
@@ -416,71 +427,11 @@ class AtlasPackHeuristicOperator(Operator):
         default = 'OCCUPIED'
     )
 
-    bias = 1e-7
-
-    def size(self, regions):
-        w = max(r.x + r.w for r in regions) - min(r.x for r in regions)
-        h = max(r.y + r.h for r in regions) - min(r.y for r in regions)
-        return w, h
-
-    def intersects(self, a, b):
-        return a is not b and a.x + self.bias < b.x + b.w and a.x + a.w - self.bias > b.x and a.y + self.bias < b.y + b.h and a.y + a.h - self.bias > b.y
-    
-    def collides(self, regions):
-        return any(self.intersects(a, b) for a in regions for b in regions)
-
-    def grid(self, v:float, step:float):
-        return math.floor(v / step) * step
-
-    def estimate_square(self, regions):
-        '''Fits in square metric'''
-        w, h = self.size(regions)
-        return abs(w - h) * (w * h)
-    
-    def estimate_occupied(self, regions):
-        '''Less free space metric'''
-        occupied = sum(r.w * r.h for r in regions)
-        w, h = self.size(regions)
-        total = w * h
-        # In theory negative values are impossible
-        return total - occupied
-
-    # TODO Performance of the outer loop can be improved by random function
-    def stick(self, regions, step):
-        '''Move regions towards origin of coordinates'''
-        def left(region):
-            horizontal = round(region.x / step)
-            for i in range(0, horizontal):
-                region.x = (horizontal - i - 1) * step
-                if any(self.intersects(region, r) for r in regions):
-                    region.x = (horizontal - i) * step
-                    break
-
-        def bottom(region):
-            vertical = round(region.y / step)
-            for i in range(0, vertical):
-                region.y = (vertical - i - 1) * step
-                if any(self.intersects(region, r) for r in regions):
-                    region.y = (vertical - i) * step
-                    break
-
-        for _ in range(len(regions)):
-            for region in regions:
-                left(region)
-                bottom(region)
-
-    def resolve(self, regions, step):
-        '''Bubble collisions'''
-        while self.collides(regions):
-            for region in regions:
-                intersections = [r for r in regions if self.intersects(region, r)]
-                if not intersections: continue
-                neighbor = choice(intersections)
-                direction = choice(('l', 't'))
-                if direction == 'l':
-                    region.x = neighbor.x + neighbor.w + self.bias * 2
-                elif direction == 't':
-                    region.y = neighbor.y + neighbor.h + self.bias * 2
+    workers:IntProperty(
+        name = 'Workers',
+        default = 1,
+        min = 1
+    )
 
     @classmethod
     def poll(cls, context:Context):
@@ -494,55 +445,32 @@ class AtlasPackHeuristicOperator(Operator):
         w, h = max(r.w for r in regions), max(r.h for r in regions)
         source_scale = 1 / max(w, h)
         for region in regions:
-            region.w = region.w * source_scale
-            region.h = region.h * source_scale
-
-        # Define grid step
-        scale = 1000
-        step = reduce(math.gcd, [round(r.w * scale) for r in regions] + [round(r.h * scale) for r in regions]) / scale
-        step = max(step, 1 / scale)
-        step = min(step, 20 / scale)
+            region.transform(w = region.w * source_scale, h = region.h * source_scale)
+        sizes = [(r.w, r.h) for r in regions]
 
         # Pack
-        prev = time.time()
-        elapsed = 0
-        best = None
-        weight = 0
-        while elapsed <= self.time:
-            generated = [self.Rect(r, 0, 0, r.w, r.h) for r in regions]
-
-            self.resolve(generated, step)
-            self.stick(generated, step)
-            if self.metric == 'SQUARE':
-                w = self.estimate_square(generated)
-            elif self.metric == 'OCCUPIED':
-                w = self.estimate_occupied(generated)
-            if best is None or w < weight:
-                best = generated
-                weight = w
-
-            t = time.time()
-            elapsed += t - prev
-            prev = t
-            # break
+        if self.workers > 1:
+            weight, best, trials = pack.search_parallel(sizes, self.metric, self.time, self.workers)
+        else:
+            weight, best, trials = pack.search(sizes, self.metric, self.time)
 
         assert(best is not None)
 
         # Apply result
         if self.scale:
-            w, h = self.size(best)
+            w, h = pack.size(best)
             source_scale = max(w, h)
-        for region in best:
-            region.proto.x = region.x / source_scale
-            region.proto.y = region.y / source_scale
-            region.proto.w = region.w / source_scale
-            region.proto.h = region.h / source_scale
-        dx = min(r.proto.x for r in best)
-        dy = min(r.proto.y for r in best)
-        for region in best:
-            region.proto.x -= dx
-            region.proto.y -= dy
-
+        dx = min(r.x for r in best)
+        dy = min(r.y for r in best)
+        for rect in best:
+            regions[rect.proto].place(
+                (rect.x - dx) / source_scale,
+                (rect.y - dy) / source_scale,
+                rect.w / source_scale,
+                rect.h / source_scale
+            )
+
+        self.report({'INFO'}, f'Trials: {trials}, workers: {self.workers}, best: {weight:.6f}')
         return {'FINISHED'}
 
 
@@ -550,58 +478,37 @@ class AtlasPackHeuristicOperator(Operator):
 class AtlasPack2048Operator(Operator):
     bl_idname = 'atlas.pack_2048'
     bl_label = 'Pack Atlas'
+    bl_options = {'REGISTER', 'UNDO'}
 
     @classmethod
     def poll(cls, context:Context):
         if context.mode != 'OBJECT': return False
         if len(context.selected_objects) == 0: return False
-        if not hasattr(context.space_data, 'image'): return False
-        if context.space_data.image is None: return False
         return True
 
-    # https://blog.magnum.graphics/backstage/pot-array-packing/
-    def pack(self, atlas_size, regions):
-        output = [[0, 0] for _ in range(len(regions))]
-        
-        free = 1
-        previous_size = atlas_size
-        
-        for i, size in enumerate(regions):
-            size = list(size)
-            
-            if free == 0:
-                free = 1
-                previous_size = atlas_size
-            
-            free *= (previous_size[0] // size[0]) * (previous_size[1] // size[1])
-
-            side_slot_count = atlas_size[0] // size[0]
-            layer_depth = math.floor(math.log2(side_slot_count))
-            slot_index = side_slot_count * side_slot_count - free
-            
-            coordinates = [0, 0]
-            
-            for j in range(layer_depth):
-                if slot_index & (1 << (2 * (layer_depth - j - 1))):
-                    coordinates[0] += atlas_size[0] >> (j + 1)
-                if slot_index & (1 << (2 * (layer_depth - j - 1) + 1)):
-                    coordinates[1] += atlas_size[1] >> (j + 1)
-            
-            output[i] = [coordinates[0], coordinates[1]]
-            previous_size = size
-            free -= 1
-        
-        return output
-
     def execute(self, context:Context):
-        regions = sorted(set(o.data.region_props for o in context.selected_objects if o.type == 'MESH'), key = lambda r: max(r.w, r.h), reverse = True)
-        sorted_sizes = [(r.xw, r.xh) for r in regions]
-        result = self.pack((context.scene.atlas_props.atlas_w, context.scene.atlas_props.atlas_h), sorted_sizes)
-        for (region, (x, y)) in zip(regions, result):
-            region.xx = x
-            region.xy = y
-        if any(r.xw != r.xh or (math.log2(r.xw) % 1 != 0) or (math.log2(r.xh) % 1 != 0) for r in regions):
-            self.report({'WARNING'}, 'Algorithm works correctly only with squares')
+        context.scene.atlas_props.draw_regions = True
+
+        # NOTE Atlas size is taken from properties, so image editor isn't required
+        w = context.scene.atlas_props.atlas_w
+        h = context.scene.atlas_props.atlas_h
+        regions = list(set(o.data.region_props for o in context.selected_objects if o.type == 'MESH'))
+        sizes = [(max(round(r.w * w), 1), max(round(r.h * h), 1)) for r in regions]
+        positions = pack.pack_buddy(sizes, w, h)
+
+        for region, position in zip(regions, positions):
+            if position is None: continue
+            region.place(position[0] / w, position[1] / h)
+
+        occupied = sum(rw * rh for (rw, rh), p in zip(sizes, positions) if p is not None) / (w * h)
+        rejected = positions.count(None)
+        rounded = sum(pack.pot(rw) != rw or pack.pot(rh) != rh for rw, rh in sizes)
+        message = f'Occupied: {occupied:.1%}'
+        if rounded: message += f', {rounded} regions aren\'t powers of two and use larger slots'
+        if rejected:
+            self.report({'WARNING'}, f'{rejected} regions don\'t fit the atlas, {message}')
+        else:
+            self.report({'WARNING'} if rounded else {'INFO'}, message)
         return {'FINISHED'}
 
 
@@ -650,11 +557,133 @@ class AtlasPackShelfOperator(Operator):
             margin_x = margin_y = self.margin
         scale = max(w, h) if self.scale else 1.0
         for rect in rects:
-            rect.data.x = (rect.x + margin_x - min_x) / scale
-            rect.data.y = (rect.y + margin_y - min_y) / scale
-            rect.data.w = (rect.data.w - margin_x) / scale
-            rect.data.h = (rect.data.h - margin_y) / scale
+            rect.data.place(
+                (rect.x + margin_x - min_x) / scale,
+                (rect.y + margin_y - min_y) / scale,
+                (rect.data.w - margin_x) / scale,
+                (rect.data.h - margin_y) / scale
+            )
+
+        return {'FINISHED'}
+
+
+
+class AtlasPackMaxRectsOperator(Operator):
+    bl_idname = 'atlas.pack_maxrects'
+    bl_label = 'Pack Atlas'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    scale:BoolProperty(
+        name = 'Scale',
+        default = True
+    )
+    margin:FloatProperty(
+        name = 'Margin',
+        default = 0.0,
+        min = 0.0
+    )
+
+    @classmethod
+    def poll(cls, context:Context):
+        if context.mode != 'OBJECT': return False
+        if len(context.selected_objects) == 0: return False
+        return True
+
+    def fit(self, rects, sizes, factor:float, w:int, h:int):
+        for rect, (rw, rh) in zip(rects, sizes):
+            rect.w = rw * factor
+            rect.h = rh * factor
+        return pack.pack_maxrects(rects, w, h)
+
+    def execute(self, context:Context):
+        context.scene.atlas_props.draw_regions = True
+
+        # Pack in pixels, so margin is the same along both axes of non square atlas
+        w = context.scene.atlas_props.atlas_w
+        h = context.scene.atlas_props.atlas_h
+        regions = list(set(o.data.region_props for o in context.selected_objects if o.type == 'MESH'))
+        sizes = [(r.w * w, r.h * h) for r in regions]
+        rects = [struct.UVRect(r, r.x * w, r.y * h, rw, rh, margin = self.margin) for r, (rw, rh) in zip(regions, sizes)]
+
+        factor = 1.0
+        if self.scale:
+            # Find the largest uniform scale when all regions fit, area gives the upper bound
+            lo = 0.0
+            hi = math.sqrt(w * h / max(sum(rw * rh for rw, rh in sizes), 1e-12))
+            largest = max(max(s) for s in sizes)
+            # NOTE Bisection stops when scales differ by less than a pixel on the largest region
+            for _ in range(20):
+                if (hi - lo) * largest < 1: break
+                mid = (lo + hi) / 2
+                if self.fit(rects, sizes, mid, w, h): hi = mid
+                else: lo = mid
+            factor = lo or 1.0
+        rejected = self.fit(rects, sizes, factor, w, h)
+
+        for rect in rects:
+            if rect in rejected: continue
+            rect.data.place(rect.x / w, rect.y / h, rect.w / w, rect.h / h)
+
+        occupied = sum(r.w * r.h for r in rects if r not in rejected) / (w * h)
+        if rejected:
+            self.report({'WARNING'}, f'{len(rejected)} regions don\'t fit the atlas, occupied: {occupied:.1%}')
+        else:
+            self.report({'INFO'}, f'Occupied: {occupied:.1%}')
+        return {'FINISHED'}
+
+
+
+class AtlasPackIncrementalOperator(Operator):
+    bl_idname = 'atlas.pack_incremental'
+    bl_label = 'Pack New Regions'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    margin:FloatProperty(
+        name = 'Margin',
+        default = 0.0,
+        min = 0.0
+    )
+
+    @classmethod
+    def poll(cls, context:Context):
+        if context.mode != 'OBJECT': return False
+        if len(context.selected_objects) == 0: return False
+        return True
+
+    def execute(self, context:Context):
+        context.scene.atlas_props.draw_regions = True
+        start = time.perf_counter()
+
+        # Pack in pixels, so margin is the same along both axes of non square atlas
+        w = context.scene.atlas_props.atlas_w
+        h = context.scene.atlas_props.atlas_h
+        regions = list(set(o.data.region_props for o in context.selected_objects if o.type == 'MESH'))
+
+        # Regions keep their place unless they are new, grown, out of the atlas or overlap a kept region
+        changed = lambda r: r.packed_w <= 0 or r.w > r.packed_w + pack.bias or r.h > r.packed_h + pack.bias
+        inside = lambda r: r.x >= -pack.bias and r.y >= -pack.bias and r.x + r.w <= 1 + pack.bias and r.y + r.h <= 1 + pack.bias
+        candidates = sorted((r for r in regions if not changed(r) and inside(r)), key = lambda r: r.w * r.h * w * h, reverse = True)
+        grid = pack.SpatialGrid(max(sum(max(r.w * w, r.h * h) for r in regions) / len(regions), pack.bias * 4))
+        kept = []
+        for region in candidates:
+            rect = pack.Rect(region, region.x * w, region.y * h, region.w * w, region.h * h)
+            if grid.intersections(rect): continue
+            grid.insert(rect)
+            kept.append(rect)
+        added = set(regions) - set(r.proto for r in kept)
+        rects = [struct.UVRect(r, r.x * w, r.y * h, r.w * w, r.h * h, margin = self.margin) for r in added]
+
+        # Free space is built from the current layout, so only changed regions are placed
+        m = self.margin
+        free = pack.maxrects_free([(r.x - m, r.y - m, r.w + m * 2, r.h + m * 2) for r in kept], w, h)
+        if pack.pack_maxrects(rects, w, h, free):
+            bpy.ops.atlas.pack_maxrects(scale = context.scene.atlas_props.pack_scale, margin = self.margin)
+            self.report({'WARNING'}, f'{len(added)} regions don\'t fit the free space, atlas is repacked')
+            return {'FINISHED'}
 
+        for rect in rects:
+            rect.data.place(rect.x / w, rect.y / h)
+        self.report({'INFO'}, f'Kept: {len(kept)}, placed: {len(rects)}, time: {time.perf_counter() - start:.3f}s')
         return {'FINISHED'}
 
 
@@ -671,6 +700,7 @@ class AtlasBakeOperator(Operator):
     def execute(self, context:Context):
         context.scene.atlas_props.draw_regions = True
         print('Bake atlases')
+        self.repainted = 0
         import PIL.Image
 
         meshes:List[Mesh] = [o.data for o in context.selected_objects if o.type == 'MESH']
@@ -685,28 +715,139 @@ class AtlasBakeOperator(Operator):
         
         w = context.scene.atlas_props.atlas_w
         h = context.scene.atlas_props.atlas_h
+        workers = context.scene.atlas_props.bake_workers
         i = 0
         path = os.path.normpath(bpy.path.abspath(context.scene.atlas_props.export))
-        for layer in data.values():
-            images = [util.blender_to_pillow(r.image) for (_, r, _) in layer]
-            atlas = PIL.Image.new('RGBA', (w, h))
-            # Bake atlas
-            for ((tex, resource, region), image) in zip(layer, images):
-                image = image.resize((int(region.w * w), int(region.h * h)))
-                atlas.paste(image, (int(region.x * w), int(region.y * h)), image)
-            bpy.ops.screen.area_dupli('INVOKE_DEFAULT')
-            context.area.type = 'IMAGE_EDITOR'
-            name = f'{layer[0][1].layer}'
-            img = util.pillow_to_blender(name, atlas)
-            context.space_data.image = img
-            context.area.tag_redraw()
-            img.save(filepath = os.path.join(path, f'{name}.png'))
-            print(f'Atlas backed: {i + 1} / {len(data)}')
-            i += 1
-        self.report({'INFO'}, f'Saved {i} to {path}')
+        cache = None
+        if context.scene.atlas_props.use_cache:
+            cache_path = context.scene.atlas_props.cache_dir
+            cache_path = os.path.normpath(bpy.path.abspath(cache_path)) if cache_path else os.path.join(path, '.atlazzer_cache')
+            cache = util.ResizeCache(cache_path, context.scene.atlas_props.cache_size * 1024 * 1024)
+        incremental = context.scene.atlas_props.incremental
+        if workers > 1:
+            # NOTE Pixels are read on the main thread, Pillow releases GIL while resizing, pasting and encoding
+            pending = {}
+            resizing = set()
+            with ThreadPoolExecutor(max_workers = workers) as pool:
+                for layer in data.values():
+                    name = f'{layer[0][1].layer}'
+                    filepath = os.path.join(path, f'{name}.png')
+                    previous, sources, dirty, manifest = self.plan(layer, w, h, filepath, cache, incremental)
+                    resized = []
+                    for image, box, key in sources:
+                        # Limit sources at full resolution to one per worker, resized ones are kept at region sizes
+                        while len(resizing) >= workers:
+                            _, resizing = wait(resizing, return_when = FIRST_COMPLETED)
+                        future = pool.submit(util.fit_source, image, box[2:], cache, key)
+                        resizing.add(future)
+                        resized.append((future, box, key))
+                        del image
+                    # NOTE Resizes are queued before the layer, so the layer never waits for a resize that can't start
+                    sources = ((future.result(), box, key) for future, box, key in resized)
+                    pending[pool.submit(self.bake_layer, previous, sources, dirty, w, h, filepath, manifest, cache)] = name
+                    del sources, resized
+                    # Limit layers in flight, so memory is about an atlas and its sources per worker
+                    while len(pending) >= workers:
+                        done, _ = wait(pending, return_when = FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+                            name = pending.pop(future)
+                            self.show(context, self.load(name, os.path.join(path, f'{name}.png')))
+                            i += 1
+                            print(f'Atlas backed: {i} / {len(data)}')
+                for future in as_completed(list(pending)):
+                    future.result()
+                    name = pending.pop(future)
+                    self.show(context, self.load(name, os.path.join(path, f'{name}.png')))
+                    i += 1
+                    print(f'Atlas backed: {i} / {len(data)}')
+        else:
+            for layer in data.values():
+                name = f'{layer[0][1].layer}'
+                filepath = os.path.join(path, f'{name}.png')
+                previous, sources, dirty, manifest = self.plan(layer, w, h, filepath, cache, incremental)
+                self.bake_layer(previous, sources, dirty, w, h, filepath, manifest, cache)
+                self.show(context, self.load(name, filepath))
+                print(f'Atlas backed: {i + 1} / {len(data)}')
+                i += 1
+        if cache is not None:
+            cache.evict()
+            self.report({'INFO'}, f'Saved {i} to {path}, repainted: {self.repainted}, cache hits: {cache.hits}, misses: {cache.misses}')
+        else:
+            self.report({'INFO'}, f'Saved {i} to {path}, repainted: {self.repainted}')
 
         return {'FINISHED'}
 
+    def show(self, context:Context, image:Image):
+        # NOTE Running without UI, e.g. blender -b
+        if context.area is None: return
+        bpy.ops.screen.area_dupli('INVOKE_DEFAULT')
+        context.area.type = 'IMAGE_EDITOR'
+        context.space_data.image = image
+        context.area.tag_redraw()
+
+    def load(self, name:str, filepath:str) -> Image:
+        '''Points the layer image to the saved atlas, so materials reference the file after it is replaced'''
+        image = bpy.data.images.get(name)
+        if image is None:
+            image = bpy.data.images.load(filepath)
+            image.name = name
+            return image
+        image.filepath = filepath
+        image.source = 'FILE'
+        image.reload()
+        return image
+
+    def plan(self, layer, w:int, h:int, filepath:str, cache:util.ResizeCache|None = None, incremental = False):
+        '''Finds which items must be painted, compares placements with the manifest of the previous bake'''
+        items = []
+        entries = []
+        for (tex, resource, region) in layer:
+            if resource.image is None: continue
+            box = (int(region.x * w), int(region.y * h), int(region.w * w), int(region.h * h))
+            if not box[2] or not box[3]: continue
+            # NOTE Signatures of generated images read all pixels, so they are computed only when something compares them
+            signature = util.image_signature(resource.image) if incremental or cache is not None else None
+            items.append((resource, box, signature))
+            entries.append((region.id_data.name, signature, box))
+        manifest = {'size': [w, h], 'resample': util.resample, 'entries': entries}
+
+        previous = None
+        dirty = None
+        old = util.load_manifest(filepath) if incremental else None
+        # Full bake if the atlas size or filter changed
+        if old and old.get('size') == [w, h] and old.get('resample') == util.resample and os.path.isfile(filepath):
+            dirty = util.dirty_rects(old['entries'], entries, w, h)
+            previous = util.load_png(filepath).convert('RGBA')
+            items = [i for i in items if any(util.overlaps(i[1], d) for d in dirty)]
+        self.repainted += len(items)
+        return previous, self.sources(items, cache), dirty, manifest
+
+    def sources(self, items, cache:util.ResizeCache|None = None):
+        '''Converts resources one by one, so peak memory is about the atlas plus one source image'''
+        for (resource, box, signature) in items:
+            key = cache.key(signature, box[2:]) if cache is not None else None
+            image = cache.load(key) if key is not None else None
+            if image is None:
+                # Images which weren't loaded before are unloaded from Blender right after conversion
+                loaded = resource.image.has_data
+                image = util.blender_to_pillow(resource.image)
+                if not loaded: resource.image.buffers_free()
+            yield image, box, key
+            del image
+
+    def bake_layer(self, previous, sources, dirty, w:int, h:int, filepath:str, manifest, cache:util.ResizeCache|None = None):
+        if previous is None:
+            atlas = util.compose_atlas(sources, w, h, cache)
+        elif dirty:
+            atlas = util.recompose_atlas(previous, sources, dirty, cache)
+        else:
+            # Nothing changed, saved atlas is up to date
+            return previous
+        util.save_png(atlas, filepath)
+        util.save_manifest(filepath, manifest)
+        return atlas
+
 
 
 class AtlasReplaceResourcesOperator(Operator):
@@ -767,57 +908,67 @@ class UVUnwrapPolygonsOperator(Operator):
             mesh.uv_layers.new()
         uv = mesh.uv_layers.active
 
-        for polygon in mesh.polygons:
-            vertices = [mesh.vertices[v].co for v in polygon.vertices]
-
-            # Center vertices
-            center = Vector((sum(v.x for v in vertices), sum(v.y for v in vertices), sum(v.z for v in vertices))) / len(vertices)
-            for i, v in enumerate(vertices): vertices[i] = v - center
-
-            # Make polygon face up
-            a, b, c, *_ = vertices
-            v1 = b - a
-            v2 = c - a
-            normal = v1.cross(v2).normalized()
-            target_normal = Vector((0, 0, 1))
-            axis = normal.cross(target_normal)
-            angle = math.acos(normal.dot(target_normal))
-            matrix = Matrix.Rotation(angle, 4, axis)
-
-            for i, v in enumerate(vertices): vertices[i] = matrix @ v
-
-            # Reset polygon z rotation - make it align
-            a, b, c, *_ = vertices
-            vec = (b - a).normalized()
-            angle = math.atan2(vec.y, vec.x)
-            matrix = Matrix.Rotation(-angle, 4, Vector((0, 0, 1)))
-
-            for i, v in enumerate(vertices): vertices[i] = matrix @ v
-
-            for index, vertex in zip(polygon.loop_indices, vertices):
-                uv.data[index].uv = vertex.xy
-        
-        if self.scale:
+        import numpy as np
+
+        # Read mesh once, every array below is indexed by loop or by polygon
+        co = np.empty(len(mesh.vertices) * 3, dtype = np.float64)
+        mesh.vertices.foreach_get('co', co)
+        co = co.reshape(-1, 3)
+        indices = np.empty(len(mesh.loops), dtype = np.int64)
+        mesh.loops.foreach_get('vertex_index', indices)
+        starts = np.empty(len(mesh.polygons), dtype = np.int64)
+        mesh.polygons.foreach_get('loop_start', starts)
+        totals = np.empty(len(mesh.polygons), dtype = np.int64)
+        mesh.polygons.foreach_get('loop_total', totals)
+        order = np.argsort(starts)
+        polygon = np.repeat(order, totals[order])
+
+        # Center vertices
+        vertices = co[indices]
+        center = np.stack([np.bincount(polygon, vertices[:, i], len(starts)) for i in range(3)], axis = 1) / totals[:, None]
+        vertices -= center[polygon]
+
+        # Make polygon face up
+        a, b, c = vertices[starts], vertices[starts + 1], vertices[starts + 2]
+        normal = np.cross(b - a, c - a)
+        length = np.linalg.norm(normal, axis = 1)
+        # NOTE Degenerate polygons have no normal, they are treated as already facing up
+        normal = np.divide(normal, length[:, None], out = np.tile((0.0, 0.0, 1.0), (len(starts), 1)), where = length[:, None] > 1e-12)
+        # Rotation of normal onto z, sin is length of the axis and cos is z of the normal
+        axis = np.stack((normal[:, 1], -normal[:, 0], np.zeros(len(starts))), axis = 1)
+        cos = normal[:, 2]
+        # NOTE Polygons facing down are flipped around x, otherwise rotation is undefined
+        down = cos < -1 + 1e-9
+        k = np.where(down, 0, 1 / np.maximum(1 + cos, 1e-9))
+        u = axis[polygon]
+        cross = np.cross(u, vertices)
+        vertices = vertices + cross + np.cross(u, cross) * k[polygon, None]
+        flip = down[polygon]
+        vertices[flip, 1:] *= -1
+
+        # Reset polygon z rotation - make it align
+        vec = vertices[starts + 1, :2] - vertices[starts, :2]
+        length = np.linalg.norm(vec, axis = 1)
+        vec = np.divide(vec, length[:, None], out = np.tile((1.0, 0.0), (len(starts), 1)), where = length[:, None] > 1e-12)
+        cos, sin = vec[polygon, 0], vec[polygon, 1]
+        x, y = vertices[:, 0], vertices[:, 1]
+        coords = np.stack((x * cos + y * sin, y * cos - x * sin), axis = 1)
+
+        if self.scale and len(coords):
             material = context.active_object.active_material
             if material and material.node_tree.nodes.active and hasattr(material.node_tree.nodes.active, 'image') and material.node_tree.nodes.active.image:
                 # Set scale to image
                 w, h = material.node_tree.nodes.active.image.size
-                for item in uv.data:
-                    item.uv.x = item.uv.x / w * self.factor
-                    item.uv.y = item.uv.y / h * self.factor
+                coords *= (self.factor / w, self.factor / h)
             else:
                 # Normalize scale
-                w = (max(i.uv.x for i in uv.data) - min(i.uv.x for i in uv.data))
-                h = (max(i.uv.y for i in uv.data) - min(i.uv.y for i in uv.data))
-                scale = max(w, h)
-                for item in uv.data:
-                    item.uv = item.uv / scale * self.factor
-        
+                scale = (coords.max(axis = 0) - coords.min(axis = 0)).max()
+                if scale > 0: coords *= self.factor / scale
+
         # Center uv to uv editor
-        dx = min(i.uv.x for i in uv.data)
-        dy = min(i.uv.y for i in uv.data)
-        for item in uv.data:
-            item.uv -= Vector((dx, dy))
+        if len(coords): coords -= coords.min(axis = 0)
+        uv.uv.foreach_set('vector', coords.astype(np.float32).reshape(-1))
+        mesh.update_tag()
 
         bpy.ops.object.mode_set(mode = mode)
         return {'FINISHED'}
@@ -834,10 +985,15 @@ class UVPackRectOperator(Operator):
         default = 0.0,
         min = 0.0
     )
+    islands:BoolProperty(
+        name = 'Islands',
+        default = True
+    )
 
     def draw(self, context:Context):
         layout:UILayout = self.layout
         layout.prop(self, 'margin')
+        layout.prop(self, 'islands')
 
     @classmethod
     def poll(cls, context:Context):
@@ -854,27 +1010,29 @@ class UVPackRectOperator(Operator):
         mesh:Mesh = context.active_object.data
         uv = mesh.uv_layers.active
 
-        rects = []
+        import numpy as np
+
+        # NOTE Islands are moved as a whole, so uvs are never torn apart
+        polygon, vertices, (coords, ) = util.read_loops(mesh, uv)
+        if self.islands:
+            island, count = util.find_islands(polygon, vertices, coords)
+            labels = island[polygon]
+        else:
+            labels, count = polygon, len(mesh.polygons)
+        low, high = util.island_bounds(labels, coords, count)
+        size = high - low
+
         margin = self.margin / max(context.space_data.image.size) if hasattr(context.space_data, 'image') and context.space_data.image else self.margin
-        for polygon in mesh.polygons:
-            min_x = min(uv.data[i].uv.x for i in polygon.loop_indices)
-            min_y = min(uv.data[i].uv.y for i in polygon.loop_indices)
-            max_x = max(uv.data[i].uv.x for i in polygon.loop_indices)
-            max_y = max(uv.data[i].uv.y for i in polygon.loop_indices)
-            rects.append(struct.UVRect(polygon, min_x, min_y,
-                (max_x - min_x) + margin * 2,
-                (max_y - min_y) + margin * 2,
-                margin = margin
-            ))
+        rects = [struct.UVRect(i, x, y, w + margin * 2, h + margin * 2, margin = margin)
+            for i, ((x, y), (w, h)) in enumerate(zip(low.tolist(), size.tolist()))]
 
         util.pack_shelf_decreasing_high(rects, (len(rects) ** 0.5) * (sum(r.w for r in rects) / len(rects)))
 
-        for rect in rects:
-            min_x = min(uv.data[i].uv.x for i in rect.data.loop_indices)
-            min_y = min(uv.data[i].uv.y for i in rect.data.loop_indices)
-            for index in rect.data.loop_indices:
-                uv.data[index].uv.x = rect.x + (uv.data[index].uv.x - min_x) + rect.margin
-                uv.data[index].uv.y = rect.y + (uv.data[index].uv.y - min_y) + rect.margin
+        position = np.empty((count, 2), dtype = np.float64)
+        position[[r.data for r in rects]] = [(r.x + r.margin, r.y + r.margin) for r in rects]
+        coords += (position - low)[labels]
+        uv.uv.foreach_set('vector', coords.reshape(-1))
+        mesh.update_tag()
 
         bpy.ops.object.mode_set(mode = mode)
         return {'FINISHED'}
@@ -906,35 +1064,25 @@ class UVTransferImageOperator(Operator):
 
         mesh = context.active_object.data
 
-        src = util.blender_to_pillow(mesh.uv_props.src_image)
-        dst = util.blender_to_pillow(mesh.uv_props.dst_image)
-
-        for polygon in mesh.polygons:
-            # Get src uv region
-            w, h = mesh.uv_props.src_image.size
-            uv = mesh.uv_layers[mesh.uv_props.src_uv]
-            src_min_x = min(uv.data[i].uv.x for i in polygon.loop_indices) * w
-            src_min_y = min(uv.data[i].uv.y for i in polygon.loop_indices) * h
-            src_max_x = max(uv.data[i].uv.x for i in polygon.loop_indices) * w
-            src_max_y = max(uv.data[i].uv.y for i in polygon.loop_indices) * h
-            
-            # Get dst uv region
-            w, h = mesh.uv_props.dst_image.size
-            uv = mesh.uv_layers[mesh.uv_props.dst_uv]
-            dst_min_x = min(uv.data[i].uv.x for i in polygon.loop_indices) * w
-            dst_min_y = min(uv.data[i].uv.y for i in polygon.loop_indices) * h
-            dst_max_x = max(uv.data[i].uv.x for i in polygon.loop_indices) * w
-            dst_max_y = max(uv.data[i].uv.y for i in polygon.loop_indices) * h
-
-            # Transfer
-            w = math.ceil(dst_max_x - dst_min_x)
-            h = math.ceil(dst_max_y - dst_min_y)
-            if not w or not h: continue
-            crop = src.crop((src_min_x, src_min_y, src_max_x, src_max_y))
-            crop = crop.resize((w, h))
-            dst.paste(crop, (int(dst_min_x), int(dst_min_y)), crop)
-        
-        util.pillow_to_blender(mesh.uv_props.dst_image.name, dst, override = True)
+        import numpy as np
+
+        src_image = mesh.uv_props.src_image
+        dst_image = mesh.uv_props.dst_image
+        src = util.read_pixels(src_image).reshape(src_image.size[1], src_image.size[0], src_image.channels)
+        dst = util.read_pixels(dst_image).reshape(dst_image.size[1], dst_image.size[0], dst_image.channels)
+        if src.shape[2] != dst.shape[2]:
+            # NOTE Missing channels are filled with ones, so missing alpha is opaque
+            expanded = np.ones(src.shape[:2] + dst.shape[2:], dtype = np.float32)
+            n = min(src.shape[2], dst.shape[2])
+            expanded[:, :, :n] = src[:, :, :n]
+            src = expanded
+
+        # Every triangle is warped from source to destination, so rotated and connected islands are transferred correctly
+        _, _, (src_coords, dst_coords) = util.read_loops(mesh, mesh.uv_layers[mesh.uv_props.src_uv], mesh.uv_layers[mesh.uv_props.dst_uv])
+        util.warp_triangles(src, dst, src_coords, dst_coords, util.loop_triangles(mesh))
+
+        util.write_pixels(dst_image, dst)
+        dst_image.update()
 
         bpy.ops.object.mode_set(mode = mode)
         return {'FINISHED'}
@@ -954,10 +1102,24 @@ class MaterialBakeOperator(Operator):
         if not context.selected_objects: return False
         return True
 
-    def execute(self, context:Context):
-        import PIL.ImageOps
-        import PIL.Image
+    # Output: (primitive passes it is derived from, colorspace)
+    plan = {
+        'albedo': (('COLOR', ), 'sRGB'),
+        # NOTE Albedo with alpha is white where a material has no color, unlike albedo
+        'albedo_alpha': (('COLOR_WHITE', 'ALPHA'), 'sRGB'),
+        'roughness': (('ROUGHNESS', ), 'Non-Color'),
+        'smooth': (('ROUGHNESS', ), 'Non-Color'),
+        'metal': (('METAL', ), 'Non-Color'),
+        'metal_roughness': (('METAL', 'ROUGHNESS'), 'Non-Color'),
+        'metal_smooth': (('METAL', 'ROUGHNESS'), 'Non-Color'),
+        'normal': (('NORMAL', ), 'Non-Color'),
+        'emission': (('EMISSION', ), 'sRGB'),
+    }
+    passes = ('COLOR', 'COLOR_WHITE', 'ALPHA', 'METAL', 'ROUGHNESS', 'NORMAL', 'EMISSION')
+    # Cycles settings overridden by fast data bake
+    fast = {'use_denoising': False, 'use_adaptive_sampling': False, 'use_auto_tile': False}
 
+    def execute(self, context:Context):
         mode = bpy.context.object.mode
         engine = context.scene.render.engine
         bpy.ops.object.mode_set(mode = 'OBJECT')
@@ -965,130 +1127,179 @@ class MaterialBakeOperator(Operator):
         active = context.view_layer.objects.active
         selected = [o for o in context.selected_objects if o.select_get()]
 
-        for obj in selected:
-            obj.select_set(False)
-            
-        for obj in selected:
-            if obj.type != 'MESH': continue
-            obj.select_set(True)
-            context.view_layer.objects.active = obj
-            mesh:Mesh = obj.data
-
-            context.scene.render.bake.target = 'IMAGE_TEXTURES'
-            context.scene.render.bake.use_clear = True
-
-            # Create textures
-            p = context.scene.material_props
+        # Each primitive pass is baked once per object, all outputs are derived from them
+        p = context.scene.material_props
+        enabled = [name for name in self.plan if getattr(p, f'bake_{name}')]
+        required = [kind for kind in self.passes if any(kind in self.plan[name][0] for name in enabled)]
+        timings = {kind: 0.0 for kind in required}
+
+        cycles = context.scene.cycles
+        state = {k: getattr(cycles, k) for k in ('samples', *self.fast) if hasattr(cycles, k)}
+        targets = []
+        # NOTE Bake fails e.g. without uv map, then user settings, nodes and selection must still be restored
+        try:
+            for obj in selected:
+                obj.select_set(False)
+
+            if p.fast_bake:
+                for k, v in self.fast.items():
+                    if k in state: setattr(cycles, k, v)
+
+            # NOTE Objects of a group are baked by one call, so scene sync and BVH build are shared
             w, h = p.width, p.height
-            if p.bake_albedo: albedo = bpy.data.images.new(obj.name + p.albedo_suffix, w, h, alpha = True, float_buffer = True)
-            if p.bake_albedo_alpha: albedo_alpha = bpy.data.images.new(obj.name + p.albedo_alpha_suffix, w, h, alpha = True, float_buffer = True)
-            if p.bake_roughness: roughness = bpy.data.images.new(obj.name + p.roughness_suffix, w, h, alpha = True, float_buffer = True)
-            if p.bake_smooth: smooth = bpy.data.images.new(obj.name + p.smooth_suffix, w, h, alpha = True, float_buffer = True)
-            if p.bake_metal: metal = bpy.data.images.new(obj.name + p.metal_suffix, w, h, alpha = True, float_buffer = True)
-            if p.bake_metal_roughness: metal_roughness = bpy.data.images.new(obj.name + p.metal_roughness_suffix, w, h, alpha = True, float_buffer = True)
-            if p.bake_metal_smooth: metal_smooth = bpy.data.images.new(obj.name + p.metal_smooth_suffix, w, h, alpha = True, float_buffer = True)
-            if p.bake_normal: normal = bpy.data.images.new(obj.name + p.normal_suffix, w, h, alpha = True, float_buffer = True)
-            if p.bake_emission: emission = bpy.data.images.new(obj.name + p.emission_suffix, w, h, alpha = True, float_buffer = True)
-
-            nodes = [(m, m.node_tree.nodes.new('ShaderNodeTexImage')) for m in mesh.materials]
-            outputs = [m.node_tree.get_output_node('ALL') for m in mesh.materials]
+            objects = [o for o in selected if o.type == 'MESH']
+            # Each object of a group holds a temporary image and a few float RGBA passes at once
+            limit = max(1, p.batch_memory * 1024 * 1024 // (w * h * 16 * 4))
+            groups = self.group(objects, limit) if p.batch_objects else [[o] for o in objects]
+            bakes = 0
+            for group in groups:
+                for obj in group:
+                    obj.select_set(True)
+                context.view_layer.objects.active = group[0]
+
+                context.scene.render.bake.target = 'IMAGE_TEXTURES'
+                context.scene.render.bake.use_clear = True
+
+                targets = []
+                for obj in group:
+                    materials = [m for m in obj.data.materials if m is not None]
+                    nodes = [(m, m.node_tree.nodes.new('ShaderNodeTexImage')) for m in materials]
+                    outputs = [m.node_tree.get_output_node('ALL') for m in materials]
+                    for material, node in nodes:
+                        material.node_tree.nodes.active = node
+                    targets.append((nodes, outputs))
+
+                buffers = [{} for _ in group]
+                derived = [{} for _ in group]
+                pending = list(enabled)
+                # Both colors are the same when every material has a color socket, so the bake is reused
+                alias = 'COLOR' in required and 'COLOR_WHITE' in required and self.has_color(targets)
+                for kind in required:
+                    if kind == 'COLOR_WHITE' and alias: continue
+                    if p.fast_bake: cycles.samples = self.samples(kind, p)
+                    start = time.perf_counter()
+                    for b, pixels in zip(buffers, self.bake_pass(kind, targets, w, h)):
+                        b[kind] = pixels
+                        if kind == 'COLOR' and alias: b['COLOR_WHITE'] = pixels
+                    timings[kind] += time.perf_counter() - start
+                    bakes += 1
+
+                    # Outputs are written as soon as their passes exist, then passes which aren't needed anymore are dropped
+                    ready = [name for name in pending if all(k in buffers[0] for k in self.plan[name][0])]
+                    pending = [name for name in pending if name not in ready]
+                    for obj, b, d in zip(group, buffers, derived):
+                        for name in ready:
+                            self.write(obj, name, self.derive(name, b, d), w, h, p)
+                        for k in [k for k in b if not any(k in self.plan[name][0] for name in pending)]:
+                            del b[k]
+                        if not any(name in ('smooth', 'metal_smooth') for name in pending): d.clear()
+                del buffers, derived
+
+                self.remove_nodes(targets)
+                targets = []
+                for obj in group:
+                    obj.select_set(False)
+        finally:
+            self.remove_nodes(targets)
+            for k, v in state.items():
+                setattr(cycles, k, v)
+            bpy.ops.object.mode_set(mode = mode)
+            context.scene.render.engine = engine
+            for obj in selected:
+                obj.select_set(True)
+            context.view_layer.objects.active = active
+
+        report = ', '.join(f'{kind}: {t:.2f}s' for kind, t in timings.items())
+        print(f'Bake passes: {report}, Cycles bakes: {bakes}')
+        self.report({'INFO'}, f'Bake passes: {report}, Cycles bakes: {bakes}')
+        return {'FINISHED'}
+
+    def remove_nodes(self, targets):
+        for nodes, _ in targets:
             for material, node in nodes:
-                material.node_tree.nodes.active = node
-            
-            if context.scene.material_props.bake_albedo:
+                material.node_tree.nodes.remove(node)
+
+    def samples(self, kind:str, p):
+        if kind == 'NORMAL': return p.normal_samples
+        if kind == 'ROUGHNESS': return p.roughness_samples
+        # NOTE Other passes are baked as emission, which doesn't need more than one sample
+        return 1
+
+    def write(self, obj:Object, name:str, pixels, w:int, h:int, p):
+        texture = bpy.data.images.new(obj.name + getattr(p, f'{name}_suffix'), w, h, alpha = True, float_buffer = True)
+        texture.use_fake_user = True
+        texture.colorspace_settings.name = self.plan[name][1]
+        util.write_pixels(texture, pixels)
+        texture.update()
+
+    def group(self, objects, limit:int):
+        '''Splits objects into groups of at most limit objects without shared materials, so each object bakes into its own image'''
+        groups = []
+        for obj in objects:
+            materials = set(m for m in obj.data.materials if m is not None)
+            for group, used in groups:
+                if len(group) < limit and used.isdisjoint(materials):
+                    group.append(obj)
+                    used |= materials
+                    break
+            else:
+                groups.append(([obj], materials))
+        return [group for group, _ in groups]
+
+    def bake_pass(self, kind:str, targets, w:int, h:int):
+        '''Bakes a primitive pass of all targets at once, each into its own temporary image, returns their pixels'''
+        temps = []
+        for nodes, _ in targets:
+            temp = bpy.data.images.new('temp', w, h, alpha = True, float_buffer = True)
+            temp.colorspace_settings.name = 'sRGB' if kind in ('COLOR', 'COLOR_WHITE', 'EMISSION') else 'Non-Color'
+            for material, node in nodes: node.image = temp
+            temps.append(temp)
+        nodes = [n for t in targets for n in t[0]]
+        outputs = [o for t in targets for o in t[1]]
+
+        try:
+            if kind == 'COLOR':
                 # NOTE We use emit to bake albedo because otherwise it is black when metal == 1
-                for material, node in nodes: node.image = albedo
-                albedo.use_fake_user = True
-                albedo.colorspace_settings.name = 'sRGB'
-                state = [self.use_emission(m, n, m.node_tree.get_output_node('ALL'), m.node_tree.get_output_node('ALL'), 'Base Color', 'Color') for m, n in nodes]
-                bpy.ops.object.bake(type = 'EMIT')
-                for (material, node), (e, output_connection) in zip(nodes, state):
-                    self.unuse_emission(material, material.node_tree.get_output_node('ALL'), e, output_connection)
-            if context.scene.material_props.bake_albedo_alpha:
-                albedo_alpha.use_fake_user = True
-                temp1 = bpy.data.images.new('temp1', w, h, alpha = True, float_buffer = True)
-                temp2 = bpy.data.images.new('temp2', w, h, alpha = True, float_buffer = True)
-                # Bake albedo
-                for material, node in nodes: node.image = temp1
-                temp1.colorspace_settings.name = 'sRGB'
-                state = [self.use_emission(m, n, m.node_tree.get_output_node('ALL'), m.node_tree.get_output_node('ALL'), 'Base Color', 'Color', default_ = (1, 1, 1, 1)) for m, n in nodes]
-                bpy.ops.object.bake(type = 'EMIT')
-                for (material, node), (e, output_connection) in zip(nodes, state):
-                    self.unuse_emission(material, material.node_tree.get_output_node('ALL'), e, output_connection)
-                # Bake alpha
-                for material, node in nodes: node.image = temp2
-                temp2.colorspace_settings.name = 'sRGB'
-                state = [self.use_emission(m, n, m.node_tree.get_output_node('ALL'), m.node_tree.get_output_node('ALL'), 'Alpha') for m, n in nodes]
-                bpy.ops.object.bake(type = 'EMIT')
-                for (material, node), (e, output_connection) in zip(nodes, state):
-                    self.unuse_emission(material, material.node_tree.get_output_node('ALL'), e, output_connection)
-                # Combine
-                r, g, b, *_ = util.blender_to_pillow(temp1).split()
-                a, *_ = util.blender_to_pillow(temp2).split()
-                util.pillow_to_blender(albedo_alpha.name, PIL.Image.merge('RGBA', (r, g, b, a)), override = True, colorspace = 'sRGB')
-                #
-                bpy.data.images.remove(temp1)
-                bpy.data.images.remove(temp2)
-            if context.scene.material_props.bake_roughness:
-                roughness.use_fake_user = True
-                roughness.colorspace_settings.name = 'Non-Color'
-                self.bake_roughness(nodes, roughness)
-            if context.scene.material_props.bake_smooth:
-                smooth.use_fake_user = True
-                self.bake_smooth(nodes, smooth, w, h)
-            if context.scene.material_props.bake_metal:
-                metal.use_fake_user = True
-                metal.colorspace_settings.name = 'Non-Color'
-                self.bake_metal(nodes, outputs, metal)
-            if context.scene.material_props.bake_metal_roughness:
-                metal_roughness.use_fake_user = True
-                temp1 = bpy.data.images.new('temp1', w, h, alpha = True, float_buffer = True)
-                temp2 = bpy.data.images.new('temp2', w, h, alpha = True, float_buffer = True)
-                temp1.colorspace_settings.name = 'Non-Color'
-                temp2.colorspace_settings.name = 'Non-Color'
-                self.bake_metal(nodes, outputs, temp1)
-                self.bake_roughness(nodes, temp2)
-                #
-                r, *_ = util.blender_to_pillow(temp1).split()
-                a, *_ = util.blender_to_pillow(temp2).split()
-                util.pillow_to_blender(metal_roughness.name, PIL.Image.merge('RGBA', (r, r, r, a)), override = True, colorspace = 'Non-Color')
-                #
-                bpy.data.images.remove(temp1)
-                bpy.data.images.remove(temp2)
-            if context.scene.material_props.bake_metal_smooth:
-                metal_smooth.use_fake_user = True
-                temp1 = bpy.data.images.new('temp1', w, h, alpha = True, float_buffer = True)
-                temp2 = bpy.data.images.new('temp2', w, h, alpha = True, float_buffer = True)
-                self.bake_metal(nodes, outputs, temp1)
-                self.bake_smooth(nodes, temp2, w, h)
-                r, *_ = util.blender_to_pillow(temp1).split()
-                a, *_ = util.blender_to_pillow(temp2).split()
-                #
-                util.pillow_to_blender(metal_smooth.name, PIL.Image.merge('RGBA', (r, r, r, a)), override = True, colorspace = 'Non-Color')
-                #
-                bpy.data.images.remove(temp1)
-                bpy.data.images.remove(temp2)
-            if context.scene.material_props.bake_normal:
-                for material, node in nodes: node.image = normal
-                normal.use_fake_user = True
-                normal.colorspace_settings.name = 'Non-Color'
+                self.bake_emission(nodes, 'Base Color', 'Color')
+            elif kind == 'COLOR_WHITE':
+                self.bake_emission(nodes, 'Base Color', 'Color', default_ = (1, 1, 1, 1))
+            elif kind == 'ALPHA':
+                self.bake_emission(nodes, 'Alpha')
+            elif kind == 'METAL':
+                self.bake_metal(nodes, outputs)
+            elif kind == 'ROUGHNESS':
+                self.bake_roughness()
+            elif kind == 'NORMAL':
                 bpy.ops.object.bake(type = 'NORMAL')
-            if context.scene.material_props.bake_emission:
-                for material, node in nodes: node.image = emission
-                emission.use_fake_user = True
-                emission.colorspace_settings.name = 'sRGB'
+            elif kind == 'EMISSION':
                 bpy.ops.object.bake(type = 'EMIT')
-            
-            for material, node in nodes:
-                material.node_tree.nodes.remove(node)
-            obj.select_set(False)
-
-        bpy.ops.object.mode_set(mode = mode)
-        context.scene.render.engine = engine
-        for obj in selected:
-            obj.select_set(True)
-        context.view_layer.objects.active = active
-        return {'FINISHED'}
+            return [util.read_pixels(temp).reshape(-1, temp.channels) for temp in temps]
+        finally:
+            for temp in temps:
+                bpy.data.images.remove(temp)
+
+    def bake_emission(self, nodes, *sockets, default_ = (0, 0, 0, 1)):
+        state = [self.use_emission(m, n, m.node_tree.get_output_node('ALL'), m.node_tree.get_output_node('ALL'), *sockets, default_ = default_) for m, n in nodes]
+        try:
+            bpy.ops.object.bake(type = 'EMIT')
+        finally:
+            for (material, node), (e, output_connection) in zip(nodes, state):
+                self.unuse_emission(material, material.node_tree.get_output_node('ALL'), e, output_connection)
+
+    def derive(self, name:str, buffers, derived):
+        '''Builds output pixels from primitive passes, smooth is computed once and shared'''
+        if name in ('smooth', 'metal_smooth') and 'smooth' not in derived:
+            derived['smooth'] = self.smooth(buffers['ROUGHNESS'])
+        if name == 'albedo': return buffers['COLOR']
+        if name == 'albedo_alpha': return self.combine(buffers['COLOR_WHITE'], buffers['ALPHA'])
+        if name == 'roughness': return buffers['ROUGHNESS']
+        if name == 'smooth': return derived['smooth']
+        if name == 'metal': return buffers['METAL']
+        if name == 'metal_roughness': return self.combine(buffers['METAL'], buffers['ROUGHNESS'], gray = True)
+        if name == 'metal_smooth': return self.combine(buffers['METAL'], derived['smooth'], gray = True)
+        if name == 'normal': return buffers['NORMAL']
+        if name == 'emission': return buffers['EMISSION']
+        raise ValueError(f'Unknown output: {name}')
 
     def find_principled(self, root):
         if root.type == 'BSDF_PRINCIPLED': return root
@@ -1097,17 +1308,25 @@ class MaterialBakeOperator(Operator):
                 principled = self.find_principled(link.from_node)
                 if principled: return principled
 
-    def use_emission(self, material, texture, output, root, *sockets, default_ = (0, 0, 0, 1)):
-        def walk(node, sockets:Tuple[str]):
-            for input in node.inputs:
-                if input.name in sockets: return node
-                for link in input.links:
-                    n = walk(link.from_node, sockets)
-                    if n: return n
+    def walk(self, node, sockets:Tuple[str]):
+        '''Finds a node with one of the sockets among the node and its inputs'''
+        for input in node.inputs:
+            if input.name in sockets: return node
+            for link in input.links:
+                n = self.walk(link.from_node, sockets)
+                if n: return n
+
+    def has_color(self, targets):
+        '''Whether every material of the targets has a color socket, so the color default is never used'''
+        for nodes, outputs in targets:
+            for output in outputs:
+                if not output or not self.walk(output, ('Base Color', 'Color')): return False
+        return True
 
+    def use_emission(self, material, texture, output, root, *sockets, default_ = (0, 0, 0, 1)):
         # Find a node with a specific socket name
         # We will link its socket connection with emission for baking
-        target = walk(root, sockets)
+        target = self.walk(root, sockets)
 
         if target:
             input = next(i for i in target.inputs if i.name in sockets)
@@ -1137,13 +1356,14 @@ class MaterialBakeOperator(Operator):
         if output_connection:
             material.node_tree.links.new(output_connection, output.inputs['Surface'])
 
-    def bake_metal(self, nodes, outputs, texture):
+    def bake_metal(self, nodes, outputs):
         trash = []
         # Prepare
         # NOTE Metal will be baked as emission, so we should create emission shader, connect, bake, and restore previous connnections
         for (material, node), output in zip(nodes, outputs):
-            node.image = texture
-            if not output: continue
+            if not output:
+                trash.append((None, None))
+                continue
             principled = self.find_principled(output)
             metallic = principled.inputs['Metallic'] if principled else None
             prev = output.inputs['Surface'].links[0].from_socket if output.inputs['Surface'].links else None
@@ -1155,38 +1375,32 @@ class MaterialBakeOperator(Operator):
             material.node_tree.links.new(emission.outputs['Emission'], output.inputs['Surface'])
             material.node_tree.nodes.active = node
 
-        bpy.ops.object.bake(type = 'EMIT')
-
-        # Restore state
-        for (material, node), output, (emission, prev) in zip(nodes, outputs, trash):
-            if not output: continue
-            material.node_tree.nodes.remove(emission)
-            material.node_tree.links.new(prev, output.inputs['Surface'])
+        try:
+            bpy.ops.object.bake(type = 'EMIT')
+        finally:
+            # Restore state
+            for (material, node), output, (emission, prev) in zip(nodes, outputs, trash):
+                if not output: continue
+                material.node_tree.nodes.remove(emission)
+                if prev: material.node_tree.links.new(prev, output.inputs['Surface'])
     
-    def bake_roughness(self, nodes, texture):
-        for material, node in nodes:
-            node.image = texture
+    def bake_roughness(self):
         bpy.ops.object.bake(type = 'ROUGHNESS')
     
-    def bake_smooth(self, nodes, texture, w, h):
-        import PIL.ImageOps
-        import PIL.Image
-        temp = bpy.data.images.new('temp', w, h, alpha = True, float_buffer = True)
-        for material, node in nodes:
-            node.image = temp
-        bpy.ops.object.bake(type = 'ROUGHNESS')
-
-        r, g, b, *_ = util.blender_to_pillow(temp).split()
-        img = util.blender_to_pillow(temp)
-        pixels = img.load()
+    def smooth(self, roughness):
+        import numpy as np
+        pixels = roughness.copy()
         # Invert with gamma space
-        for i in range(img.width):
-            for j in range(img.height):
-                r, g, b, a = pixels[i, j]
-                r = (1 - (r / 255) ** 2.2) * 255
-                g = (1 - (g / 255) ** 2.2) * 255
-                b = (1 - (b / 255) ** 2.2) * 255
-                pixels[i, j] = (int(r), int(g), int(b), a)
-        util.pillow_to_blender(texture.name, img, override = True, colorspace = 'Non-Color')
-        
-        bpy.data.images.remove(temp)
+        rgb = pixels[:, :3]
+        np.clip(rgb, 0, 1, out = rgb)
+        np.power(rgb, 2.2, out = rgb)
+        np.subtract(1, rgb, out = rgb)
+        return pixels
+
+    def combine(self, color, alpha, gray = False):
+        '''Takes rgb (or red as gray) of color and red of alpha pixels'''
+        import numpy as np
+        pixels = np.empty((len(color), 4), dtype = np.float32)
+        pixels[:, :3] = color[:, :1] if gray else color[:, :3]
+        pixels[:, 3] = alpha[:, 0]
+        return pixels
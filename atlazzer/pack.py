@@ -0,0 +1,350 @@
+import heapq
+import json
+import math
+import random
+import subprocess
+import sys
+import time
+
+# NOTE This module must not depend on bpy, so packing can run and be benchmarked outside Blender
+
+bias = 1e-7
+
+class Rect:
+    def __init__(self, proto, x:float, y:float, w:float, h:float):
+        self.proto = proto
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+
+
+
+class SpatialGrid:
+    '''Uniform grid of cells, each cell stores rects which overlap it'''
+
+    def __init__(self, cell:float):
+        self.cell = cell
+        self.cells = {}
+        self.keys = {}
+
+    def span(self, x:float, y:float, w:float, h:float):
+        c = self.cell
+        return math.floor(x / c), math.floor(y / c), math.floor((x + w) / c), math.floor((y + h) / c)
+
+    def insert(self, rect:Rect):
+        x0, y0, x1, y1 = self.span(rect.x, rect.y, rect.w, rect.h)
+        keys = [(i, j) for i in range(x0, x1 + 1) for j in range(y0, y1 + 1)]
+        for key in keys:
+            self.cells.setdefault(key, set()).add(rect)
+        self.keys[rect] = keys
+
+    def remove(self, rect:Rect):
+        for key in self.keys.pop(rect):
+            cell = self.cells[key]
+            cell.discard(rect)
+            if not cell: del self.cells[key]
+
+    def move(self, rect:Rect, x:float, y:float):
+        '''Moves rect and updates only cells it leaves or enters'''
+        if self.span(rect.x, rect.y, rect.w, rect.h) == self.span(x, y, rect.w, rect.h):
+            rect.x = x
+            rect.y = y
+            return
+        self.remove(rect)
+        rect.x = x
+        rect.y = y
+        self.insert(rect)
+
+    def query(self, x:float, y:float, w:float, h:float):
+        x0, y0, x1, y1 = self.span(x, y, w, h)
+        found = set()
+        for i in range(x0, x1 + 1):
+            for j in range(y0, y1 + 1):
+                cell = self.cells.get((i, j))
+                if cell: found |= cell
+        return found
+
+    def intersections(self, rect:Rect):
+        return [r for r in self.query(rect.x, rect.y, rect.w, rect.h) if intersects(rect, r)]
+
+    def slide_left(self, rect:Rect):
+        '''Moves rect to the nearest obstacle on the left or to zero'''
+        x0, y0, x1, y1 = self.span(rect.x, rect.y, rect.w, rect.h)
+        # The nearest obstacle is registered in the cell containing its right edge,
+        # so the first column with a blocking rect contains the answer
+        for i in range(x0, -1, -1):
+            edges = [r.x + r.w for j in range(y0, y1 + 1) for r in self.cells.get((i, j), ())
+                if r is not rect and r.x + r.w <= rect.x + bias and overlaps_y(rect, r)]
+            if edges:
+                self.move(rect, max(edges), rect.y)
+                return
+        self.move(rect, 0, rect.y)
+
+    def slide_bottom(self, rect:Rect):
+        '''Moves rect to the nearest obstacle below or to zero'''
+        x0, y0, x1, y1 = self.span(rect.x, rect.y, rect.w, rect.h)
+        for j in range(y0, -1, -1):
+            edges = [r.y + r.h for i in range(x0, x1 + 1) for r in self.cells.get((i, j), ())
+                if r is not rect and r.y + r.h <= rect.y + bias and overlaps_x(rect, r)]
+            if edges:
+                self.move(rect, rect.x, max(edges))
+                return
+        self.move(rect, rect.x, 0)
+
+
+
+def overlaps_x(a:Rect, b:Rect):
+    return a.x + bias < b.x + b.w and a.x + a.w - bias > b.x
+
+def overlaps_y(a:Rect, b:Rect):
+    return a.y + bias < b.y + b.h and a.y + a.h - bias > b.y
+
+def intersects(a:Rect, b:Rect):
+    return a is not b and overlaps_x(a, b) and overlaps_y(a, b)
+
+def size(rects):
+    w = max(r.x + r.w for r in rects) - min(r.x for r in rects)
+    h = max(r.y + r.h for r in rects) - min(r.y for r in rects)
+    return w, h
+
+def estimate_square(rects):
+    '''Fits in square metric'''
+    w, h = size(rects)
+    return abs(w - h) * (w * h)
+
+def estimate_occupied(rects):
+    '''Less free space metric'''
+    occupied = sum(r.w * r.h for r in rects)
+    w, h = size(rects)
+    total = w * h
+    # In theory negative values are impossible
+    return total - occupied
+
+estimators = {
+    'SQUARE': estimate_square,
+    'OCCUPIED': estimate_occupied
+}
+
+def create_grid(rects):
+    # Cell of the average rect size keeps both the number of cells per rect and rects per cell small
+    cell = max(sum(max(r.w, r.h) for r in rects) / len(rects), bias * 4)
+    grid = SpatialGrid(cell)
+    for rect in rects:
+        grid.insert(rect)
+    return grid
+
+def resolve(rects, grid:SpatialGrid, rng = random):
+    '''Bubble collisions'''
+    moved = True
+    while moved:
+        moved = False
+        for rect in rects:
+            intersections = grid.intersections(rect)
+            if not intersections: continue
+            neighbor = rng.choice(intersections)
+            if rng.choice(('l', 't')) == 'l':
+                grid.move(rect, neighbor.x + neighbor.w + bias * 2, rect.y)
+            else:
+                grid.move(rect, rect.x, neighbor.y + neighbor.h + bias * 2)
+            moved = True
+
+def stick(rects, grid:SpatialGrid):
+    '''Move rects towards origin of coordinates'''
+    for _ in range(len(rects)):
+        moved = False
+        for rect in rects:
+            x, y = rect.x, rect.y
+            grid.slide_left(rect)
+            grid.slide_bottom(rect)
+            moved = moved or (x, y) != (rect.x, rect.y)
+        if not moved: break
+
+def trial(sizes, metric:str, rng = random):
+    '''Runs one randomized packing, returns its weight and rects'''
+    rects = [Rect(i, 0, 0, w, h) for i, (w, h) in enumerate(sizes)]
+    grid = create_grid(rects)
+    resolve(rects, grid, rng)
+    stick(rects, grid)
+    return estimators[metric](rects), rects
+
+def search(sizes, metric:str, duration:float, seed = None):
+    '''Runs trials until duration elapses, returns the best weight, its rects and the number of trials'''
+    rng = random.Random(seed)
+    start = time.time()
+    best = None
+    weight = 0
+    trials = 0
+    while best is None or time.time() - start <= duration:
+        w, rects = trial(sizes, metric, rng)
+        trials += 1
+        if best is None or w < weight:
+            best = rects
+            weight = w
+    return weight, best, trials
+
+def search_parallel(sizes, metric:str, duration:float, workers:int, seed = None):
+    '''Same as search, but trials run in separate python processes with their own seeds'''
+    seed = random.randrange(2 ** 32) if seed is None else seed
+    # NOTE Isolated mode keeps the addon folder out of sys.path, otherwise operator.py shadows the standard module
+    processes = [subprocess.Popen([sys.executable, '-I', __file__],
+        stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = sys.stderr
+    ) for _ in range(workers)]
+    for i, process in enumerate(processes):
+        process.stdin.write(json.dumps({
+            'sizes': sizes,
+            'metric': metric,
+            'duration': duration,
+            'seed': seed + i
+        }).encode())
+        process.stdin.close()
+
+    best = None
+    weight = 0
+    trials = 0
+    for process in processes:
+        output = process.stdout.read()
+        process.stdout.close()
+        if process.wait() != 0: continue
+        result = json.loads(output)
+        trials += result['trials']
+        if best is None or result['weight'] < weight:
+            best = [Rect(i, *r) for i, r in enumerate(result['rects'])]
+            weight = result['weight']
+
+    # Fallback if all workers failed
+    if best is None:
+        return search(sizes, metric, duration, seed)
+    return weight, best, trials
+
+def maxrects_place(free, w:float, h:float):
+    '''Finds the free rect with the best short side fit, returns its position or None'''
+    best = None
+    score = None
+    for fx, fy, fw, fh in free:
+        if w > fw + bias or h > fh + bias: continue
+        dw = fw - w
+        dh = fh - h
+        s = (min(dw, dh), max(dw, dh), fy, fx)
+        if score is None or s < score:
+            best = (fx, fy)
+            score = s
+    return best
+
+def maxrects_split(free, x:float, y:float, w:float, h:float):
+    '''Splits free rects overlapped by the placed rect into maximal remainders'''
+    kept = []
+    touching = []
+    created = []
+    x0, y0, x1, y1 = x - bias, y - bias, x + w + bias, y + h + bias
+    for f in free:
+        fx, fy, fw, fh = f
+        # Rects within bias of the placed one are touching, deeper ones are overlapped
+        if fx + fw < x0 or fx > x1 or fy + fh < y0 or fy > y1:
+            kept.append(f)
+            continue
+        if fx + fw <= x + bias or fx >= x + w - bias or fy + fh <= y + bias or fy >= y + h - bias:
+            kept.append(f)
+            touching.append(f)
+            continue
+        if x > fx + bias: created.append((fx, fy, x - fx, fh))
+        if x + w < fx + fw - bias: created.append((x + w, fy, fx + fw - x - w, fh))
+        if y > fy + bias: created.append((fx, fy, fw, y - fy))
+        if y + h < fy + fh - bias: created.append((fx, y + h, fw, fy + fh - y - h))
+
+    def contains(a, b):
+        return a[0] <= b[0] + bias and a[1] <= b[1] + bias and a[0] + a[2] >= b[0] + b[2] - bias and a[1] + a[3] >= b[1] + b[3] - bias
+
+    # NOTE Kept rects can't be inside each other or inside new ones, because new ones are parts of previously pruned rects.
+    # Every new rect has a side on the placed rect, so only kept rects touching the placed rect may contain it
+    for i, c in enumerate(created):
+        if any(contains(k, c) for k in touching): continue
+        if any(contains(o, c) and (j < i or not contains(c, o)) for j, o in enumerate(created) if j != i): continue
+        kept.append(c)
+    return kept
+
+def maxrects_free(occupied, w:float, h:float):
+    '''Free rects of w * h bin around already occupied (x, y, w, h) rects'''
+    free = [(0, 0, w, h)]
+    for x, y, ow, oh in occupied:
+        free = maxrects_split(free, x, y, ow, oh)
+    return free
+
+def pack_maxrects(rects, w:float, h:float, free = None):
+    '''MaxRects with best short side fit, places rects with x, y, w, h and margin into w * h bin
+
+    Margin is reserved around each rect, rect position is set inside of it.
+    Free rects of a partially occupied bin may be passed to insert rects into the existing layout.
+    Returns rects that didn't fit, their position is unchanged.
+    '''
+    free = [(0, 0, w, h)] if free is None else free
+    rejected = []
+    for rect in sorted(rects, key = lambda r: (max(r.w, r.h), min(r.w, r.h)), reverse = True):
+        rw = rect.w + rect.margin * 2
+        rh = rect.h + rect.margin * 2
+        position = maxrects_place(free, rw, rh)
+        if position is None:
+            rejected.append(rect)
+            continue
+        rect.x = position[0] + rect.margin
+        rect.y = position[1] + rect.margin
+        free = maxrects_split(free, position[0], position[1], rw, rh)
+    return rejected
+
+def pot(value:int):
+    '''Smallest power of two which is not less than value'''
+    return 1 << max(int(value) - 1, 0).bit_length()
+
+# https://en.wikipedia.org/wiki/Buddy_memory_allocation
+def pack_buddy(sizes, w:int, h:int):
+    '''Buddy allocator of power of two slots in w * h atlas, sizes are integer pixels
+
+    Atlas is covered with power of two blocks by bits of its sides, blocks are halved along the longer
+    side relative to the request until they fit the slot, other halves become free blocks.
+    Sizes which are not powers of two get the enclosing slot.
+    Returns position of each size in the original order, None if it didn't fit.
+    '''
+    # Free blocks by (log2 w, log2 h), bottom left blocks first
+    free = {}
+    def release(x:int, y:int, bw:int, bh:int):
+        heapq.heappush(free.setdefault((bw.bit_length() - 1, bh.bit_length() - 1), []), (y, x))
+
+    y = 0
+    for j in reversed(range(int(h).bit_length())):
+        if not h >> j & 1: continue
+        x = 0
+        for i in reversed(range(int(w).bit_length())):
+            if not w >> i & 1: continue
+            release(x, y, 1 << i, 1 << j)
+            x += 1 << i
+        y += 1 << j
+
+    positions = [None] * len(sizes)
+    # NOTE Decreasing slots never leave holes smaller than the next request, so power of two squares fill the atlas completely
+    order = sorted(range(len(sizes)), key = lambda i: (pot(sizes[i][0]) * pot(sizes[i][1]), max(pot(sizes[i][0]), pot(sizes[i][1]))), reverse = True)
+    for i in order:
+        sw, sh = pot(sizes[i][0]).bit_length() - 1, pot(sizes[i][1]).bit_length() - 1
+        # Smallest free block which contains the slot
+        candidates = [k for k, blocks in free.items() if blocks and k[0] >= sw and k[1] >= sh]
+        if not candidates: continue
+        key = min(candidates, key = lambda k: (k[0] + k[1], abs((k[0] - sw) - (k[1] - sh)), free[k][0]))
+        y, x = heapq.heappop(free[key])
+        bw, bh = key
+        while (bw, bh) != (sw, sh):
+            if bw - sw >= bh - sh:
+                bw -= 1
+                release(x + (1 << bw), y, 1 << bw, 1 << bh)
+            else:
+                bh -= 1
+                release(x, y + (1 << bh), 1 << bw, 1 << bh)
+        positions[i] = (x, y)
+    return positions
+
+if __name__ == '__main__':
+    request = json.load(sys.stdin)
+    weight, rects, trials = search(request['sizes'], request['metric'], request['duration'], request['seed'])
+    json.dump({
+        'weight': weight,
+        'rects': [(r.x, r.y, r.w, r.h) for r in rects],
+        'trials': trials
+    }, sys.stdout)
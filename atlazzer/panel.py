@@ -22,6 +22,8 @@ class AtlazzerPanel(Panel):
 
         region_props = context.scene.atlas_props
         layout.prop(region_props, 'draw_regions')
+        if region_props.draw_regions:
+            layout.prop(region_props, 'draw_islands')
 
         layout.label(text = 'Atlas Size')
         row = layout.row()
@@ -50,17 +52,29 @@ class AtlazzerPanel(Panel):
             heuristic = pack.operator('atlas.pack_heuristic', text = '4. Pack Atlas Heuristic')
             pack.prop(context.scene.atlas_props, 'pack_analysis_time')
             pack.prop(context.scene.atlas_props, 'pack_scale')
+            pack.prop(context.scene.atlas_props, 'pack_workers')
             heuristic.time = context.scene.atlas_props.pack_analysis_time
             heuristic.scale = context.scene.atlas_props.pack_scale
             heuristic.metric = context.scene.atlas_props.pack_algorithm
+            heuristic.workers = context.scene.atlas_props.pack_workers
         elif context.scene.atlas_props.pack_algorithm == '2048':
             pack.operator('atlas.pack_2048', text = '4. Pack Atlas 2048')
         elif context.scene.atlas_props.pack_algorithm == 'SHELF':
             pack.operator('atlas.pack_shelf', text = '4. Pack Atlas Shelf')
+        elif context.scene.atlas_props.pack_algorithm == 'MAXRECTS':
+            pack.operator('atlas.pack_maxrects', text = '4. Pack Atlas MaxRects')
+        pack.operator('atlas.pack_incremental')
         col.operator('atlas.bake', text = '5. Bake Atlas')
         col.operator('atlas.replace_resources', text = '6. Replace Images By Atlas')
 
         layout.prop(context.scene.atlas_props, 'export')
+        layout.prop(context.scene.atlas_props, 'bake_workers')
+        layout.prop(context.scene.atlas_props, 'incremental')
+        col = layout.column(align = True)
+        col.prop(context.scene.atlas_props, 'use_cache')
+        if context.scene.atlas_props.use_cache:
+            col.prop(context.scene.atlas_props, 'cache_dir')
+            col.prop(context.scene.atlas_props, 'cache_size')
 
 
 
@@ -202,7 +216,6 @@ class AtlazzerUVPanel(Panel):
             row = col.row(align = True)
             row.prop(context.active_object.data.uv_props, 'dst_uv')
             row.prop(context.active_object.data.uv_props, 'dst_image')
-            col.label(text = 'WARNING! Only works for separate uv islands without connections!')
 
 
 
@@ -226,6 +239,14 @@ class AtlazzerMaterialPanel(Panel):
         row = layout.row(align = True)
         row.prop(context.scene.material_props, 'width')
         row.prop(context.scene.material_props, 'height')
+        layout.prop(context.scene.material_props, 'batch_objects')
+        if context.scene.material_props.batch_objects:
+            layout.prop(context.scene.material_props, 'batch_memory')
+        layout.prop(context.scene.material_props, 'fast_bake')
+        if context.scene.material_props.fast_bake:
+            row = layout.row(align = True)
+            row.prop(context.scene.material_props, 'normal_samples', text = 'Normal')
+            row.prop(context.scene.material_props, 'roughness_samples', text = 'Roughness')
         layout.prop(context.scene.material_props, 'preset')
         row = layout.row()
         row.prop(context.scene.material_props, 'bake_albedo')
@@ -10,10 +10,21 @@ from . draw import Painter
 regions_painter = None
 def set_regions(self, value:bool):
     global regions_painter
+    # There is nothing to draw without UI
+    if bpy.app.background: return
     if regions_painter is None and value:
-        regions_painter = SpaceImageEditor.draw_handler_add(Painter.uvsquare([o for o in bpy.context.selected_objects if o.type == 'MESH'], thickness = 3), (), 'WINDOW', 'POST_VIEW')
+        Painter.invalidate()
+        # NOTE Handlers are persistent, so the overlay keeps following the file that is opened later
+        bpy.app.handlers.depsgraph_update_post.append(Painter.invalidate)
+        bpy.app.handlers.load_post.append(Painter.reset)
+        regions_painter = SpaceImageEditor.draw_handler_add(Painter.uvsquare(thickness = 3), (), 'WINDOW', 'POST_VIEW')
     elif regions_painter is not None and not value:
         SpaceImageEditor.draw_handler_remove(regions_painter, 'WINDOW')
+        Painter.islands.clear()
+        if Painter.invalidate in bpy.app.handlers.depsgraph_update_post:
+            bpy.app.handlers.depsgraph_update_post.remove(Painter.invalidate)
+        if Painter.reset in bpy.app.handlers.load_post:
+            bpy.app.handlers.load_post.remove(Painter.reset)
         regions_painter = None
 
 
@@ -24,6 +35,10 @@ class AtlasProperties(PropertyGroup):
         set = set_regions,
         get = lambda self: regions_painter is not None
     )
+    draw_islands:BoolProperty(
+        name = 'Draw UV Islands',
+        default = False
+    )
     atlas_w:IntProperty(
         name = 'Atlas Width',
         default = 1024,
@@ -54,13 +69,19 @@ class AtlasProperties(PropertyGroup):
         name = 'Pack Scale',
         default = True
     )
+    pack_workers:IntProperty(
+        name = 'Pack Workers',
+        default = 1,
+        min = 1
+    )
     pack_algorithm:EnumProperty(
         name = 'Pack Algorithm',
         items = [
             ('SQUARE', 'Square', '', 1),
             ('OCCUPIED', 'Occupied', '', 2),
             ('2048', '2048', '', 3),
-            ('SHELF', 'Shelf', '', 4)
+            ('SHELF', 'Shelf', '', 4),
+            ('MAXRECTS', 'MaxRects', '', 5)
         ],
         default = 'OCCUPIED'
     )
@@ -69,6 +90,29 @@ class AtlasProperties(PropertyGroup):
         subtype = 'DIR_PATH',
         default = '//'
     )
+    bake_workers:IntProperty(
+        name = 'Bake Workers',
+        default = 1,
+        min = 1
+    )
+    incremental:BoolProperty(
+        name = 'Incremental Bake',
+        default = True
+    )
+    use_cache:BoolProperty(
+        name = 'Use Cache',
+        default = False
+    )
+    cache_dir:StringProperty(
+        name = 'Cache',
+        subtype = 'DIR_PATH',
+        default = ''
+    )
+    cache_size:IntProperty(
+        name = 'Cache Size (MB)',
+        default = 1024,
+        min = 0
+    )
 
 
 
@@ -88,29 +132,54 @@ class RegionProperties(PropertyGroup):
     py:FloatProperty(default = 0)
     pw:FloatProperty(default = 1)
     ph:FloatProperty(default = 1)
+    # Size of the region when it was packed last time, zero if it has never been packed
+    packed_w:FloatProperty(default = 0)
+    packed_h:FloatProperty(default = 0)
 
     def move_x(self, value:float):
-        for co in self.id_data.uv_layers.active.uv:
-            co.vector.x += value - self.px
-        self.px = value
+        self.transform(x = value)
     
     def move_y(self, value:float):
-        for co in self.id_data.uv_layers.active.uv:
-            co.vector.y += value - self.py
-        self.py = value
+        self.transform(y = value)
     
     def resize_w(self, value:float):
-        # NOTE If we use 0 or negative valeus, uv will collapse into point and we couldn't restore it
-        value = max(value, 0.001)
-        for co in self.id_data.uv_layers.active.uv:
-            co.vector.x = (co.vector.x - self.px) / self.pw * value + self.px if self.pw > 0 else 0
-        self.pw = value
+        self.transform(w = value)
     
     def resize_h(self, value:float):
-        value = max(value, 0.001)
-        for co in self.id_data.uv_layers.active.uv:
-            co.vector.y = (co.vector.y - self.py) / self.ph * value + self.py if self.ph > 0 else 0
-        self.ph = value
+        self.transform(h = value)
+
+    def place(self, x:float, y:float, w:float|None = None, h:float|None = None):
+        '''Transforms region and remembers the size it was packed with'''
+        self.transform(x, y, w, h)
+        self.packed_w = self.pw
+        self.packed_h = self.ph
+
+    def transform(self, x:float|None = None, y:float|None = None, w:float|None = None, h:float|None = None):
+        '''Moves and resizes region with a single read and write of uv layer'''
+        import numpy as np
+
+        x = self.px if x is None else x
+        y = self.py if y is None else y
+        # NOTE If we use 0 or negative valeus, uv will collapse into point and we couldn't restore it
+        w = self.pw if w is None else max(w, 0.001)
+        h = self.ph if h is None else max(h, 0.001)
+        if (x, y, w, h) == (self.px, self.py, self.pw, self.ph): return
+
+        uv = self.id_data.uv_layers.active.uv
+        coords = np.empty(len(uv) * 2, dtype = np.float32)
+        uv.foreach_get('vector', coords)
+        coords = coords.reshape(-1, 2)
+        # Relative to previous origin, scaled by new size and moved to new origin
+        coords -= (self.px, self.py)
+        coords *= (w / self.pw if self.pw > 0 else 0, h / self.ph if self.ph > 0 else 0)
+        coords += (x, y)
+        uv.foreach_set('vector', coords.reshape(-1))
+        self.id_data.update_tag()
+
+        self.px = x
+        self.py = y
+        self.pw = w
+        self.ph = h
 
 
 
@@ -149,6 +218,29 @@ class MaterialProperties(PropertyGroup):
         default = 1024,
         min = 1
     )
+    batch_objects:BoolProperty(
+        name = 'Batch Objects',
+        default = True
+    )
+    batch_memory:IntProperty(
+        name = 'Batch Memory (MB)',
+        default = 4096,
+        min = 1
+    )
+    fast_bake:BoolProperty(
+        name = 'Fast Data Bake',
+        default = True
+    )
+    normal_samples:IntProperty(
+        name = 'Normal Samples',
+        default = 16,
+        min = 1
+    )
+    roughness_samples:IntProperty(
+        name = 'Roughness Samples',
+        default = 16,
+        min = 1
+    )
 
     bake_albedo:BoolProperty(
         name = 'Bake Albedo',
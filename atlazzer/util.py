@@ -1,7 +1,12 @@
 import subprocess
 import os, sys
-from typing import List
+from typing import List, Tuple
 import re
+import hashlib
+import functools
+import bisect
+import threading
+import json
 
 import bpy
 from bpy.types import Image
@@ -20,60 +25,231 @@ def install_module(mod:str, version:str|None, path:str):
     )
     return result.returncode == 0
 
+# Blender channels count to Pillow mode
+pillow_modes = {1: 'L', 3: 'RGB', 4: 'RGBA'}
+# Filter used to resize images into atlas regions
+resample = 'BICUBIC'
+
+def read_pixels(image:Image):
+    '''Reads pixels into a flat float32 array without creating per-pixel objects'''
+    import numpy as np
+
+    w, h = image.size
+    pixels = np.empty(w * h * image.channels, dtype = np.float32)
+    image.pixels.foreach_get(pixels)
+    return pixels
+
+def write_pixels(image:Image, pixels):
+    '''Writes a flat float32 array into the image pixels'''
+    import numpy as np
+
+    pixels = np.ascontiguousarray(pixels, dtype = np.float32).reshape(-1)
+    assert len(pixels) == image.size[0] * image.size[1] * image.channels
+    image.pixels.foreach_set(pixels)
+
 def blender_to_pillow(image:Image):
+    import numpy as np
     import PIL.Image
-        
+
     w, h = image.size
-    # Convert into list of pixels to improve performance
-    pixels = list(image.pixels)
-
-    if image.channels == 1:
-        img = PIL.Image.new('L', (w, h))
-        img.putdata([(int(pixels[i] * 255), ) for i in range(0, len(pixels), 1)])
-    elif image.channels == 3:
-        img = PIL.Image.new('RGB', (w, h))
-        img.putdata([(int(pixels[i] * 255), int(pixels[i + 1] * 255), int(pixels[i + 2] * 255)) for i in range(0, len(pixels), 3)])
-    elif image.channels == 4:
-        img = PIL.Image.new('RGBA', (w, h))
-        img.putdata([(int(pixels[i] * 255), int(pixels[i + 1] * 255), int(pixels[i + 2] * 255), int(pixels[i + 3] * 255)) for i in range(0, len(pixels), 4)])
-    else:
-        raise 'Failed to convert mode'
+    mode = pillow_modes.get(image.channels)
+    if mode is None:
+        raise ValueError('Failed to convert mode')
+
+    # Quantize in place, so the only allocations are the float and the byte buffers
+    pixels = read_pixels(image)
+    np.clip(pixels, 0, 1, out = pixels)
+    pixels *= 255
+    data = pixels.astype(np.uint8)
+    del pixels
+
+    # NOTE Pillow keeps a reference to the buffer, so no copy is made here
+    img = PIL.Image.frombuffer(mode, (w, h), data, 'raw', mode, 0, 1)
 
     # img.show()
 
     return img
 
 def pillow_to_blender(name:str|None, image, override = False, colorspace = 'sRGB') -> Image:
+    import numpy as np
     import PIL.Image
     image:PIL.Image = image
 
     w, h = image.size
-    pixels = list(image.getdata())
+    if image.mode not in pillow_modes.values():
+        raise ValueError('Failed to convert mode')
 
     img = bpy.data.images.get(name) if override else None
-    if image.mode == 'L':
-        img = img or bpy.data.images.new(name, width = w, height = h, alpha = False, float_buffer = True)
-        img.colorspace_settings.name = colorspace
-        pixels_float = [(min(max(r / 255, 0), 1), ) for r in pixels]
-        img.pixels = [channel for pixel in pixels_float for channel in pixel]
-    elif image.mode == 'RGB':
-        img = img or bpy.data.images.new(name, width = w, height = h, alpha = False, float_buffer = True)
-        img.colorspace_settings.name = colorspace
-        pixels_float = [(min(max(r / 255, 0), 1), min(max(g / 255, 0), 1), min(max(b / 255, 0), 1)) for r, g, b in pixels]
-        img.pixels = [channel for pixel in pixels_float for channel in pixel]
-    elif image.mode == 'RGBA':
-        img = img or bpy.data.images.new(name, width = w, height = h, alpha = True, float_buffer = True)
-        img.colorspace_settings.name = colorspace
-        pixels_float = [(min(max(r / 255, 0), 1), min(max(g / 255, 0), 1), min(max(b / 255, 0), 1), min(max(a / 255, 0), 1)) for r, g, b, a in pixels]
-        img.pixels = [channel for pixel in pixels_float for channel in pixel]
-    else:
-        raise 'Failed to convert mode'
-    
-    assert len(img.pixels) == img.size[0] * img.size[1] * img.channels
+    img = img or bpy.data.images.new(name, width = w, height = h, alpha = image.mode == 'RGBA', float_buffer = True)
+    img.colorspace_settings.name = colorspace
+
+    # Bytes are already in [0, 255], so the normalized values don't need clamping
+    pixels = np.frombuffer(image.tobytes(), dtype = np.uint8).reshape(-1, len(image.mode)).astype(np.float32)
+    pixels *= 1 / 255
+    # NOTE Blender images usually have 4 channels even without alpha, so gray and rgb are expanded
+    if pixels.shape[1] != img.channels:
+        expanded = np.ones((len(pixels), img.channels), dtype = np.float32)
+        if pixels.shape[1] == 1:
+            expanded[:, :min(img.channels, 3)] = pixels
+        else:
+            n = min(img.channels, pixels.shape[1])
+            expanded[:, :n] = pixels[:, :n]
+        pixels = expanded
+    write_pixels(img, pixels)
 
     img.update()
     return img
 
+def save_png(image, filepath:str, **kwargs):
+    '''Saves Pillow image converted from Blender, rows are bottom up in Blender and top down in files'''
+    import PIL.Image
+
+    image.transpose(PIL.Image.Transpose.FLIP_TOP_BOTTOM).save(filepath, 'PNG', **kwargs)
+
+def load_png(filepath:str):
+    '''Loads image saved by save_png with rows in Blender order'''
+    import PIL.Image
+
+    with PIL.Image.open(filepath) as image:
+        return image.transpose(PIL.Image.Transpose.FLIP_TOP_BOTTOM)
+
+def image_signature(image:Image):
+    '''Identifies image content without reading pixels when it is backed by an unchanged file'''
+    parts = [image.channels, tuple(image.size)]
+    filepath = bpy.path.abspath(image.filepath) if image.filepath else ''
+    if image.packed_file:
+        parts.append(hashlib.sha1(image.packed_file.data).hexdigest())
+    elif not image.is_dirty and filepath and os.path.isfile(filepath):
+        stat = os.stat(filepath)
+        parts.extend((os.path.normpath(filepath), stat.st_mtime_ns, stat.st_size))
+    else:
+        parts.append(hashlib.sha1(read_pixels(image)).hexdigest())
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+def fit_source(image, size:Tuple[int, int], cache = None, key = None):
+    '''Resizes image to the region size unless it already has it, resized image is stored in the cache by key'''
+    import PIL.Image
+
+    if image.size == tuple(size): return image
+    image = image.resize(tuple(size), getattr(PIL.Image.Resampling, resample))
+    if cache is not None and key is not None: cache.store(key, image)
+    return image
+
+def compose_atlas(sources, w:int, h:int, cache = None):
+    '''Pastes (image, (x, y, w, h), key) items into a new RGBA atlas, sources may be a lazy iterator
+
+    Images are resized unless they already have the target size, resized images are stored in the cache by key.
+    '''
+    import PIL.Image
+
+    atlas = PIL.Image.new('RGBA', (w, h))
+    for image, (x, y, iw, ih), key in sources:
+        image = fit_source(image, (iw, ih), cache, key)
+        atlas.paste(image, (x, y), image)
+        del image
+    return atlas
+
+
+def recompose_atlas(atlas, sources, dirty, cache = None):
+    '''Repaints only dirty (x, y, w, h) rects of the atlas, sources must contain every item overlapping them'''
+    import PIL.Image
+
+    # Each dirty rect is composed from scratch, so overlapping dirty rects stay consistent
+    canvases = [PIL.Image.new('RGBA', (dw, dh)) for (_, _, dw, dh) in dirty]
+    for image, (x, y, iw, ih), key in sources:
+        image = fit_source(image, (iw, ih), cache, key)
+        for canvas, rect in zip(canvases, dirty):
+            if not overlaps((x, y, iw, ih), rect): continue
+            canvas.paste(image, (x - rect[0], y - rect[1]), image)
+        del image
+    for canvas, (dx, dy, _, _) in zip(canvases, dirty):
+        atlas.paste(canvas, (dx, dy))
+    return atlas
+
+def overlaps(a, b):
+    return a[0] < b[0] + b[2] and a[0] + a[2] > b[0] and a[1] < b[1] + b[3] and a[1] + a[3] > b[1]
+
+def dirty_rects(previous, current, w:int, h:int):
+    '''Compares [mesh, signature, (x, y, w, h)] manifest entries, returns rects which must be repainted'''
+    previous = [(m, s, tuple(b)) for m, s, b in previous]
+    current = [(m, s, tuple(b)) for m, s, b in current]
+    old = set(previous)
+    new = set(current)
+    changed = old ^ new
+    # Paste order defines the result where regions overlap
+    if not changed and previous != current:
+        return [(0, 0, w, h)]
+    dirty = []
+    for _, _, (x, y, rw, rh) in changed:
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + rw, w), min(y + rh, h)
+        if x1 > x0 and y1 > y0 and (x0, y0, x1 - x0, y1 - y0) not in dirty:
+            dirty.append((x0, y0, x1 - x0, y1 - y0))
+    return dirty
+
+def manifest_path(filepath:str):
+    return os.path.splitext(filepath)[0] + '.atlazzer.json'
+
+def load_manifest(filepath:str):
+    try:
+        with open(manifest_path(filepath)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def save_manifest(filepath:str, manifest):
+    with open(manifest_path(filepath), 'w') as file:
+        json.dump(manifest, file)
+
+
+
+class ResizeCache:
+    '''Disk cache of resized images, least recently used files are evicted when the size limit is exceeded'''
+
+    def __init__(self, path:str, limit:int):
+        self.path = path
+        self.limit = limit
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok = True)
+
+    def key(self, signature:str, size:Tuple[int, int]):
+        return hashlib.sha1(repr((signature, size, resample)).encode()).hexdigest()
+
+    def file(self, key:str):
+        return os.path.join(self.path, f'{key}.png')
+
+    def load(self, key:str):
+        import PIL.Image
+
+        file = self.file(key)
+        with self.lock:
+            if not os.path.isfile(file):
+                self.misses += 1
+                return None
+            self.hits += 1
+            # Modification time is used as the last access time for eviction
+            os.utime(file)
+        return load_png(file)
+
+    def store(self, key:str, image):
+        file = self.file(key)
+        # Write into a temporary file first, so concurrent readers never see a partial image
+        temp = f'{file}.{threading.get_ident()}.tmp'
+        save_png(image, temp, compress_level = 1)
+        os.replace(temp, file)
+
+    def evict(self):
+        with self.lock:
+            files = [os.path.join(self.path, f) for f in os.listdir(self.path) if f.endswith('.png')]
+            files = sorted(((os.stat(f), f) for f in files), key = lambda i: i[0].st_mtime)
+            total = sum(stat.st_size for stat, _ in files)
+            for stat, file in files:
+                if total <= self.limit: break
+                os.remove(file)
+                total -= stat.st_size
+
 def apply_gamma_correction(image):
     assert(image.mode == 'L')
     return image.point(gamma_table)
@@ -107,15 +283,265 @@ def pack_shelf_decreasing_high(rects, w:float):
     
     return rects
 
+def read_loops(mesh, *layers):
+    '''Reads polygon of each loop, loop vertices and loop uvs of the layers into arrays'''
+    import numpy as np
+
+    starts = np.empty(len(mesh.polygons), dtype = np.int64)
+    mesh.polygons.foreach_get('loop_start', starts)
+    totals = np.empty(len(mesh.polygons), dtype = np.int64)
+    mesh.polygons.foreach_get('loop_total', totals)
+    # NOTE Loops of a polygon are contiguous, so polygons sorted by start cover loops in order
+    order = np.argsort(starts)
+    polygon = np.repeat(order, totals[order])
+    vertices = np.empty(len(mesh.loops), dtype = np.int64)
+    mesh.loops.foreach_get('vertex_index', vertices)
+    coords = []
+    for layer in layers:
+        c = np.empty(len(mesh.loops) * 2, dtype = np.float32)
+        layer.uv.foreach_get('vector', c)
+        coords.append(c.reshape(-1, 2))
+    return polygon, vertices, coords
+
+def find_islands(polygon, vertices, coords, epsilon = 1e-5):
+    '''Groups polygons connected by edges with the same vertices and uvs, returns island of each polygon and number of islands
+
+    Polygons on the same side of a shared edge overlap in uv space, e.g. faces stacked by Unwrap Polygons, so they aren't connected.
+    Coords may contain several uv layers side by side, then polygons must be connected in all of them.
+    '''
+    import numpy as np
+
+    count = int(polygon.max()) + 1 if len(polygon) else 0
+    if not count: return np.zeros(0, dtype = np.int64), 0
+    loops = np.arange(len(polygon))
+    coords = np.asarray(coords, dtype = np.float64).reshape(len(polygon), -1)
+    quantized = np.floor(coords / epsilon + 0.5).astype(np.int64)
+
+    # Edge of each loop goes to the next loop of its polygon, ends are ordered by vertex so both polygons have the same edge
+    first = np.flatnonzero(np.concatenate(([True], polygon[1:] != polygon[:-1])))
+    following = loops + 1
+    following[np.append(first[1:], len(polygon)) - 1] = first
+    swap = vertices > vertices[following]
+    start = np.where(swap, following, loops)
+    end = np.where(swap, loops, following)
+
+    # Equal rows are adjacent after sorting, consecutive different rows start a new key
+    rows = np.column_stack((vertices[start], vertices[end], quantized[start], quantized[end]))
+    order = np.lexsort(rows.T[::-1])
+    rows = rows[order]
+    key = np.empty(len(rows), dtype = np.int64)
+    key[order] = np.cumsum(np.concatenate(([0], (rows[1:] != rows[:-1]).any(axis = 1))))
+
+    # Polygon lies left of its loops when its signed uv area is positive, the side flips when the edge is reversed
+    # NOTE Unlike the polygon center it also holds for concave polygons
+    layers = coords.reshape(len(polygon), -1, 2)
+    cross = layers[:, :, 0] * layers[following][:, :, 1] - layers[:, :, 1] * layers[following][:, :, 0]
+    area = np.stack([np.bincount(polygon, c, count) for c in cross.T], axis = 1)
+    side = np.sign(area[polygon]) * np.where(swap, -1, 1)[:, None]
+
+    # Each edge links its polygon with the polygon of the first loop of the same edge if they lie on opposite sides
+    head = np.full(key.max() + 1, len(polygon), dtype = np.int64)
+    np.minimum.at(head, key, loops)
+    other = head[key]
+    linked = (other != loops) & (side * side[other] < 0).all(axis = 1)
+    a = polygon[linked]
+    b = polygon[other[linked]]
+
+    # Union-find on all links at once, roots are hooked to the smaller root and paths are fully compressed
+    parent = np.arange(count)
+    while True:
+        ra = parent[a]
+        rb = parent[b]
+        changed = ra != rb
+        if not changed.any(): break
+        np.minimum.at(parent, np.maximum(ra, rb)[changed], np.minimum(ra, rb)[changed])
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent): break
+            parent = grand
+
+    _, island = np.unique(parent, return_inverse = True)
+    island = island.reshape(-1)
+    return island, int(island.max()) + 1
+
+def island_bounds(labels, coords, count:int):
+    '''Min and max of coords grouped by label, labels must cover range of count'''
+    import numpy as np
+
+    order = np.argsort(labels, kind = 'stable')
+    starts = np.searchsorted(labels[order], np.arange(count))
+    low = np.minimum.reduceat(coords[order], starts)
+    high = np.maximum.reduceat(coords[order], starts)
+    return low, high
+
+def loop_triangles(mesh):
+    '''Triangulates polygons with Blender, so concave polygons are covered exactly, returns loop indices with shape (n, 3)'''
+    import numpy as np
+
+    mesh.calc_loop_triangles()
+    triangles = np.empty(len(mesh.loop_triangles) * 3, dtype = np.int64)
+    mesh.loop_triangles.foreach_get('loops', triangles)
+    return triangles.reshape(-1, 3)
+
+def sample_bilinear(image, x, y):
+    '''Samples (h, w, c) pixels at pixel space coords, pixel centers are at half integers, borders are clamped'''
+    import numpy as np
+
+    h, w = image.shape[:2]
+    flat = image.reshape(-1, image.shape[2])
+    x = np.clip(x - 0.5, 0, w - 1)
+    y = np.clip(y - 0.5, 0, h - 1)
+    x0 = np.minimum(x.astype(np.int64), max(w - 2, 0))
+    y0 = np.minimum(y.astype(np.int64), max(h - 2, 0))
+    fx = (x - x0)[:, None]
+    fy = (y - y0)[:, None]
+    # NOTE Flat indices make a single gather per corner, which is much faster than indexing two axes
+    i = y0 * w + x0
+    dx = 1 if w > 1 else 0
+    dy = w if h > 1 else 0
+    top = flat.take(i, axis = 0)
+    top += (flat.take(i + dx, axis = 0) - top) * fx
+    bottom = flat.take(i + dy, axis = 0)
+    bottom += (flat.take(i + dy + dx, axis = 0) - bottom) * fx
+    top += (bottom - top) * fy
+    return top
+
+def warp_triangles(src, dst, src_coords, dst_coords, triangles, tile = 512, budget = 1 << 22):
+    '''Rasterizes triangles of dst uvs into (h, w, c) dst pixels, sampling src pixels at the same barycentric point of src uvs
+
+    Dst must be contiguous, it is modified in place. Destination is processed tile by tile and triangles of a tile
+    in chunks of at most budget pixels, so memory doesn't depend on the mesh and the image size.
+    Colors are blended over dst by source alpha when there are 4 channels.
+    '''
+    import numpy as np
+
+    sh, sw = src.shape[:2]
+    dh, dw = dst.shape[:2]
+    flat = dst.reshape(-1, dst.shape[2])
+    a, b, c = (dst_coords[triangles[:, i]].astype(np.float64) * (dw, dh) for i in range(3))
+    sa, sb, sc = (src_coords[triangles[:, i]].astype(np.float64) * (sw, sh) for i in range(3))
+
+    # NOTE Degenerate triangles have no pixels, so they are dropped before any work
+    den = (b[:, 1] - c[:, 1]) * (a[:, 0] - c[:, 0]) + (c[:, 0] - b[:, 0]) * (a[:, 1] - c[:, 1])
+    valid = np.abs(den) > 1e-12
+    den[~valid] = 1
+    low = np.maximum(np.ceil(np.minimum(np.minimum(a, b), c) - 0.5).astype(np.int64), 0)
+    high = np.minimum(np.floor(np.maximum(np.maximum(a, b), c) - 0.5).astype(np.int64) + 1, (dw, dh))
+    valid &= (high > low).all(axis = 1)
+
+    # Barycentric coordinates and the source point are affine in the pixel position,
+    # so each triangle is reduced to (x, y, constant) coefficients of l1, l2, l3 and of the source x, y
+    l1 = np.stack((b[:, 1] - c[:, 1], c[:, 0] - b[:, 0]), axis = 1) / den[:, None]
+    l2 = np.stack((c[:, 1] - a[:, 1], a[:, 0] - c[:, 0]), axis = 1) / den[:, None]
+    l1 = np.column_stack((l1, -(l1 * c).sum(axis = 1)))
+    l2 = np.column_stack((l2, -(l2 * c).sum(axis = 1)))
+    l3 = -l1 - l2
+    l3[:, 2] += 1
+    edges = (l1, l2, l3)
+    affine = [l1 * sa[:, i, None] + l2 * sb[:, i, None] + l3 * sc[:, i, None] for i in range(2)]
+
+    for ty in range(0, dh, tile):
+        for tx in range(0, dw, tile):
+            # Triangles overlapping the tile, clipped to it
+            selected = np.flatnonzero(valid & (low[:, 0] < tx + tile) & (high[:, 0] > tx) & (low[:, 1] < ty + tile) & (high[:, 1] > ty))
+            if not len(selected): continue
+            x0 = np.maximum(low[selected, 0], tx)
+            y0 = np.maximum(low[selected, 1], ty)
+            x1 = np.minimum(high[selected, 0], tx + tile)
+            y1 = np.minimum(high[selected, 1], ty + tile)
+            areas = (x1 - x0) * (y1 - y0)
+
+            # Split triangles into chunks of bounded number of pixels
+            cumulative = np.cumsum(areas)
+            begin = 0
+            while begin < len(selected):
+                # NOTE Clipped triangle is never larger than a tile, so at least one fits into a chunk
+                end = max(int(np.searchsorted(cumulative, cumulative[begin] - areas[begin] + budget, side = 'right')), begin + 1)
+                chunk = slice(begin, end)
+                begin = end
+
+                # Span of pixel centers inside of the triangle on each row of its bounds
+                rows = (y1 - y0)[chunk]
+                t = np.repeat(selected[chunk], rows)
+                py = np.repeat(y0[chunk], rows) + np.arange(rows.sum()) - np.repeat(np.cumsum(rows) - rows, rows)
+                y = py + 0.5
+                left = np.repeat(x0[chunk], rows) + 0.5
+                right = np.repeat(x1[chunk], rows) - 0.5
+                for e in edges:
+                    # Inside where ex * x + ey * y + ec >= 0
+                    ex = e[t, 0]
+                    rest = e[t, 1] * y + e[t, 2] + 1e-6
+                    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                        bound = -rest / ex
+                    left = np.where(ex > 0, np.maximum(left, bound), left)
+                    right = np.where(ex < 0, np.minimum(right, bound), right)
+                    right = np.where((ex == 0) & (rest < 0), -np.inf, right)
+                start = np.ceil(left - 0.5).astype(np.int64)
+                count = np.maximum(np.floor(right - 0.5).astype(np.int64) - start + 1, 0)
+
+                # Pixels of all spans
+                px = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count - start, count)
+                x = (px + 0.5).astype(np.float32)
+                point = [(np.repeat((m[t, 1] * y + m[t, 2]).astype(np.float32), count) + np.repeat(m[t, 0].astype(np.float32), count) * x) for m in affine]
+                color = sample_bilinear(src, *point)
+                i = np.repeat(py * dw, count) + px
+                if dst.shape[2] == 4:
+                    color += (flat.take(i, axis = 0) - color) * (1 - color[:, 3:])
+                flat[i] = color
+    return dst
+
+class NameIndex:
+    '''Sorted names and reversed names, finds items by prefix or suffix in logarithmic time'''
+
+    def __init__(self, items, key = lambda i: i.name):
+        self.items = list(items)
+        names = [key(i) for i in self.items]
+        self.prefixes = sorted(range(len(names)), key = lambda i: names[i])
+        self.prefix_keys = [names[i] for i in self.prefixes]
+        self.suffixes = sorted(range(len(names)), key = lambda i: names[i][::-1])
+        self.suffix_keys = [names[i][::-1] for i in self.suffixes]
+
+    @staticmethod
+    def search(keys:List[str], order:List[int], prefix:str):
+        start = bisect.bisect_left(keys, prefix)
+        end = start
+        while end < len(keys) and keys[end].startswith(prefix):
+            end += 1
+        return order[start:end]
+
+    def startswith(self, prefix:str):
+        return [self.items[i] for i in self.search(self.prefix_keys, self.prefixes, prefix)]
+
+    def endswith(self, suffix:str):
+        return [self.items[i] for i in self.search(self.suffix_keys, self.suffixes, suffix[::-1])]
+
+    def match(self, name:str):
+        '''Items which start or end with the name, in the original order'''
+        found = set(self.search(self.prefix_keys, self.prefixes, name))
+        found.update(self.search(self.suffix_keys, self.suffixes, name[::-1]))
+        return [self.items[i] for i in sorted(found)]
+
 # {name}, a
 # a{index}, a012
 # {name}*, abc
 # *{name}, bca
-def apply_fitler(string:str, pattern:str, **kwargs):
-    if not pattern: return string
+@functools.lru_cache(maxsize = 1024)
+def compile_fitler(pattern:str, kwargs:Tuple[Tuple[str, str], ...] = ()):
+    '''Builds regex from the filter pattern, cached by pattern and substituted values'''
+    kwargs = dict(kwargs)
     for item in re.findall(r'\{(.*?)\}', pattern):
         if item == 'index': continue
         pattern = pattern.replace('{' + item + '}', kwargs.get(item, ''))
     pattern = pattern.replace('{index}', r'\d{,}')
     pattern = pattern.replace('*', r'.{,}?')
-    return bool(re.fullmatch(pattern, string))
+    return re.compile(pattern)
+
+def apply_fitler(string:str, pattern:str, **kwargs):
+    if not pattern: return string
+    return bool(compile_fitler(pattern, tuple(sorted(kwargs.items()))).fullmatch(string))
+
+def apply_fitler_many(strings:List[str], pattern:str, **kwargs) -> List[bool]:
+    '''Matches all strings against the pattern compiled once'''
+    if not pattern: return [bool(s) for s in strings]
+    match = compile_fitler(pattern, tuple(sorted(kwargs.items()))).fullmatch
+    return [bool(match(s)) for s in strings]
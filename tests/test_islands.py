@@ -0,0 +1,41 @@
+import os, sys
+
+import pytest
+
+# NOTE The add-on imports bpy, so the test runs with Blender's python, e.g. blender -b --python-expr "import pytest; pytest.main(['tests'])"
+pytest.importorskip('bpy')
+np = pytest.importorskip('numpy')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from atlazzer import util
+
+# Polygons of the default cube
+cube = [[0, 4, 6, 2], [3, 2, 6, 7], [7, 6, 4, 5], [5, 1, 3, 7], [1, 0, 2, 3], [5, 4, 0, 1]]
+square = [(0, 0), (1, 0), (1, 1), (0, 1)]
+
+def test_unwrapped_polygons_are_separate_islands():
+    # Unwrap Polygons puts every face into the same square starting from its first edge
+    polygon = np.repeat(np.arange(len(cube)), 4)
+    vertices = np.array(sum(cube, []))
+    coords = np.tile(square, (len(cube), 1)).astype(np.float32)
+    island, count = util.find_islands(polygon, vertices, coords)
+    assert count == len(cube)
+    assert sorted(island.tolist()) == list(range(len(cube)))
+
+def test_connected_strip_is_one_island():
+    n = 4
+    polygon = np.repeat(np.arange(n), 4)
+    vertices = np.array(sum([[i, i + 1, n + 2 + i, n + 1 + i] for i in range(n)], []))
+    coords = np.array(sum([[(i, 0), (i + 1, 0), (i + 1, 1), (i, 1)] for i in range(n)], []), dtype = np.float32)
+    island, count = util.find_islands(polygon, vertices, coords)
+    assert count == 1
+    low, high = util.island_bounds(island[polygon], coords, count)
+    assert low.tolist() == [[0, 0]] and high.tolist() == [[n, 1]]
+
+def test_concave_polygon_is_connected():
+    # Vertex mean of the chevron lies outside of it, on the side of the triangle
+    polygon = np.array([0, 0, 0, 0, 1, 1, 1])
+    vertices = np.array([0, 1, 2, 3, 0, 3, 4])
+    coords = np.array([(0, 0), (2, 1), (0, 2), (1, 1), (0, 0), (1, 1), (0.2, 1)], dtype = np.float32)
+    island, count = util.find_islands(polygon, vertices, coords)
+    assert count == 1